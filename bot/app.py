@@ -1,27 +1,54 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
-import json
-import base64
 import requests
 from datetime import datetime
 import uuid
-import re
 import time
+import math
+import threading
 import traceback
 
+from geo import LocationError, validate_location, get_hn_municipalities
+from state import PendingRequest, create_pending_store
+from snapshot import SnapshotManager, GithubSource, LocalFileSource, register_index
+from storage import StorageError, create_storage
+import tracing
+from tracing import span
+from tiles import TileIndex, MAX_ZOOM
+from messages import MessageCatalog, chunk_lines, request_keyboard, pending_keyboard
+
 app = Flask(__name__)
 CORS(app)
+# Registrar primero para que la traza cubra también el middleware de logs
+tracing.init_app(app)
 
 # Configuración
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN', '')
 GITHUB_REPO = os.getenv('GITHUB_REPO', 'Miller1313/direccionesSLV')
 GITHUB_FILE = 'locations.json'
+LOCATIONS_FILE = os.getenv(
+    'LOCATIONS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', GITHUB_FILE)
+)
+# 'github' o 'local'; por defecto local si no hay GITHUB_TOKEN
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', '')
+STORAGE_FSYNC = os.getenv('STORAGE_FSYNC', '') == '1'
+LOCATIONS_REFRESH_INTERVAL = int(os.getenv('LOCATIONS_REFRESH_INTERVAL', 60))
+# Vida de las solicitudes pendientes, tope de memoria y aviso previo a expirar
+PENDING_TTL_HOURS = float(os.getenv('PENDING_TTL_HOURS', 72))
+PENDING_MAX = int(os.getenv('PENDING_MAX', 5000))
+PENDING_REMIND_HOURS = float(os.getenv('PENDING_REMIND_HOURS', 12))
+PENDING_SWEEP_INTERVAL = int(os.getenv('PENDING_SWEEP_INTERVAL', 300))
 PORT = int(os.getenv('PORT', 10000))
 
-# Almacenamiento en memoria
-pending_requests = {}
+# Solicitudes pendientes (SQLite compartido entre workers si PENDING_DB está configurado)
+pending_requests = create_pending_store(
+    ttl=PENDING_TTL_HOURS * 3600,
+    max_size=PENDING_MAX,
+    remind_before=PENDING_REMIND_HOURS * 3600
+)
 app_start_time = time.time()
 
 # Configuración de países SIMPLIFICADA
@@ -32,6 +59,28 @@ COUNTRIES = {
     'PA': {'name': 'Panamá', 'emoji': '🇵🇦', 'code': 'pa'}
 }
 
+# Mensajes del bot precompilados por país (MarkdownV2)
+messages = MessageCatalog(COUNTRIES, lang=os.getenv('BOT_LANGUAGE', 'es'))
+
+# Índices derivados que se reconstruyen con cada snapshot
+register_index('tiles', TileIndex)
+
+# Persistencia de ubicaciones aprobadas
+storage = create_storage(
+    STORAGE_BACKEND, COUNTRIES, GITHUB_REPO, GITHUB_FILE, GITHUB_TOKEN,
+    LOCATIONS_FILE, fsync=STORAGE_FSYNC
+)
+
+# Snapshot de ubicaciones aprobadas (cargado en warmup, recargado en segundo plano)
+if storage.name == 'local':
+    locations = SnapshotManager(storage, interval=LOCATIONS_REFRESH_INTERVAL)
+else:
+    locations = SnapshotManager(
+        GithubSource(GITHUB_REPO, GITHUB_FILE, GITHUB_TOKEN),
+        fallback=LocalFileSource(LOCATIONS_FILE),
+        interval=LOCATIONS_REFRESH_INTERVAL
+    )
+
 # ========== MIDDLEWARE ==========
 @app.before_request
 def log_request_info():
@@ -56,17 +105,8 @@ def log_request_info():
 def home():
     """Página de inicio del servidor"""
     try:
-        total_locations = 0
-        try:
-            # Intentar contar ubicaciones del archivo
-            url = f"https://raw.githubusercontent.com/{GITHUB_REPO}/main/{GITHUB_FILE}"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                for country in COUNTRIES:
-                    total_locations += len(data.get(country, {}))
-        except:
-            pass
+        # Contar ubicaciones del snapshot precargado
+        total_locations = locations.current.count(COUNTRIES)
         
         html = f'''
         <!DOCTYPE html>
@@ -220,12 +260,14 @@ def home():
                     <div class="config-item"><code>POST /send-notification</code> - Enviar solicitudes</div>
                     <div class="config-item"><code>GET /health</code> - Estado del servidor</div>
                     <div class="config-item"><code>GET /approve/&lt;id&gt;</code> - Aprobar desde navegador</div>
+                    <div class="config-item"><code>GET /tiles/&lt;z&gt;/&lt;x&gt;/&lt;y&gt;?pais=HN</code> - Clusters para mapas</div>
                 </div>
                 
                 <div class="stats">
                     <strong>🔧 Configuración:</strong><br>
                     <div class="config-item">• Telegram Token: <code>{"✅ CONFIGURADO" if TELEGRAM_TOKEN else "❌ NO CONFIGURADO"}</code></div>
                     <div class="config-item">• GitHub Token: <code>{"✅ CONFIGURADO" if GITHUB_TOKEN else "❌ NO CONFIGURADO"}</code></div>
+                    <div class="config-item">• Almacenamiento: <code>{storage.name}</code></div>
                     <div class="config-item">• Repositorio: <code>{GITHUB_REPO}</code></div>
                     <div class="config-item">• Archivo datos: <code>{GITHUB_FILE}</code></div>
                 </div>
@@ -250,8 +292,10 @@ def health_check():
         "timestamp": datetime.now().isoformat(),
         "server_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "pending_requests": len(pending_requests),
+        "pid": os.getpid(),
         "countries_supported": list(COUNTRIES.keys()),
         "config": {
+            "storage_backend": storage.name,
             "telegram_configured": bool(TELEGRAM_TOKEN),
             "github_configured": bool(GITHUB_TOKEN),
             "github_repo": GITHUB_REPO,
@@ -273,41 +317,40 @@ def telegram_webhook():
         # Manejar mensajes de texto
         if 'message' in data:
             message = data['message'].get('text', '')
-            chat_id = data['message']['chat']['id']
+            # chat_id siempre como texto: el frontend lo envía como string
+            chat_id = str(data['message']['chat']['id'])
             
             print(f"📱 Mensaje de {chat_id}: {message[:50]}...")
             
+            # Comando y argumentos ('/aprobar@MiBot id1 id2' -> '/aprobar', ['id1', 'id2'])
+            parts = message.split()
+            command = parts[0].split('@')[0].lower() if parts else ''
+            args = parts[1:]
+            
             if message == '/start':
-                response_text = (
-                    "🤖 *Sistema de Aprobación Centroamérica*\n\n"
-                    "Recibo solicitudes de nuevas ubicaciones para:\n"
-                    "🇭🇳 Honduras\n🇸🇻 El Salvador\n🇨🇷 Costa Rica\n🇵🇦 Panamá\n\n"
-                    "*Comandos disponibles:*\n"
-                    "/start - Mostrar este mensaje\n"
-                    "/lista - Ver solicitudes pendientes\n"
-                    "/paises - Ver países soportados\n"
-                    "/ayuda - Mostrar ayuda"
-                )
-                send_telegram_message(chat_id, response_text)
+                send_telegram_message(chat_id, messages.text('start'))
             
             elif message == '/lista' or message == '/list':
                 show_pending_requests(chat_id)
             
             elif message == '/paises' or message == '/countries':
-                paises_text = "\n".join([f"{c['emoji']} *{c['name']}*" for c in COUNTRIES.values()])
-                send_telegram_message(chat_id, f"*🌎 Países soportados:*\n\n{paises_text}")
+                send_telegram_message(chat_id, messages.text('countries'))
             
             elif message == '/ayuda' or message == '/help':
-                send_telegram_message(chat_id,
-                    "📋 *Ayuda del Sistema*\n\n"
-                    "*Cómo funciona:*\n"
-                    "1. Los usuarios agregan ubicaciones desde la web\n"
-                    "2. Llegan aquí como solicitudes pendientes\n"
-                    "3. Usa los botones para aprobar/rechazar\n\n"
-                    "*Comandos:*\n"
-                    "/lista - Ver solicitudes\n"
-                    "/paises - Países disponibles"
-                )
+                send_telegram_message(chat_id, messages.text('help'))
+            
+            # Moderación en lote
+            elif command in ('/aprobar_todo', '/approve_all', '/rechazar_todo', '/reject_all'):
+                action = 'approve' if command in ('/aprobar_todo', '/approve_all') else 'reject'
+                pais = args[0].upper() if args else None
+                if pais and pais not in COUNTRIES:
+                    send_telegram_message(chat_id, messages.text('unsupported_country', pais=pais))
+                else:
+                    handle_batch_command(chat_id, action, collect_pending_ids(chat_id, pais))
+            
+            elif command in ('/aprobar', '/approve', '/rechazar', '/reject') and args:
+                action = 'approve' if command in ('/aprobar', '/approve') else 'reject'
+                handle_batch_command(chat_id, action, args)
             
             # Manejar aprobación por texto (backup)
             elif 'aprobar' in message.lower() or 'approve' in message.lower():
@@ -320,7 +363,7 @@ def telegram_webhook():
         # Manejar botones inline
         elif 'callback_query' in data:
             callback = data['callback_query']
-            chat_id = callback['message']['chat']['id']
+            chat_id = str(callback['message']['chat']['id'])
             message_id = callback['message']['message_id']
             callback_data = callback['data']
             
@@ -338,6 +381,22 @@ def telegram_webhook():
                 request_id = callback_data.replace('reject_', '')
                 handle_button_rejection(request_id, chat_id, message_id)
                 
+            elif callback_data.startswith('approvevisible_'):
+                # approvevisible_<ms>[_<pais>]: lo que se mostró en /lista hasta ese instante
+                parts = callback_data.split('_')
+                try:
+                    until = int(parts[1]) / 1000
+                except ValueError:
+                    until = None
+                pais = parts[2] if len(parts) > 2 else None
+                if until is None or len(parts) > 3 or (pais is not None and pais not in COUNTRIES):
+                    # Un callback mal formado no debe dar 500: Telegram lo reenviaría
+                    print(f"⚠️ Callback inválido ignorado: {callback_data}")
+                else:
+                    handle_batch_command(
+                        chat_id, 'approve', collect_pending_ids(chat_id, pais, until), message_id
+                    )
+            
             elif callback_data.startswith('copy_'):
                 request_id = callback_data.replace('copy_', '')
                 handle_copy_coords(request_id, callback['id'])
@@ -368,66 +427,38 @@ def send_notification():
         
         if not chat_id:
             return jsonify({"error": "chat_id requerido"}), 400
+        chat_id = str(chat_id)
         
-        # Validar coordenadas
-        if 'coords' not in location:
-            return jsonify({"error": "Coordenadas requeridas"}), 400
+        # Validar y parsear ubicación (coordenadas, país, límites) una sola vez
+        try:
+            location = validate_location(location, COUNTRIES)
+        except LocationError as e:
+            print(f"⚠️ Ubicación rechazada: {e}")
+            return jsonify({"error": str(e)}), 400
         
-        # Validar país
-        pais = location.get('pais', 'HN')
-        if pais not in COUNTRIES:
-            return jsonify({"error": f"País no soportado: {pais}"}), 400
+        pais = location['pais']
         
         # Generar ID único
         request_id = str(uuid.uuid4())[:8]
         
         # Guardar en memoria
-        pending_requests[request_id] = {
-            'location': location,
-            'chat_id': chat_id,
-            'timestamp': datetime.now().isoformat(),
-            'pais': pais
-        }
+        pending_requests[request_id] = PendingRequest.from_location(location, chat_id)
         
         print(f"💾 Guardada solicitud {request_id} para {pais}")
         
         # Crear URL de Google Maps
-        try:
-            coords = location['coords'].split(',')
-            lat = coords[0].strip()
-            lon = coords[1].strip()
-            maps_url = f"https://www.google.com/maps?q={lat},{lon}"
-        except Exception as e:
-            print(f"⚠️ Error creando URL de maps: {e}")
-            maps_url = f"https://www.google.com/maps/search/{location.get('name', '')}"
+        maps_url = f"https://www.google.com/maps?q={location['lat']},{location['lon']}"
         
         # Obtener información del país
         country = COUNTRIES[pais]
         
-        # Crear mensaje para Telegram
-        message = f"""{country['emoji']} *NUEVA SOLICITUD - {country['name'].upper()}*
-
-*📌 Nombre:* {location.get('name', 'Sin nombre')}
-*📍 Coordenadas:* `{location.get('coords', 'No especificadas')}`
-*📋 Tipo:* {location.get('type', 'colonia')}
-
-*🔍 Detectado:* {location.get('detected', 'No disponible')}
-
-*🆔 ID:* `{request_id}`"""
-        
-        # Crear teclado con botones
-        keyboard = {
-            "inline_keyboard": [
-                [
-                    {"text": "✅ Aprobar", "callback_data": f"approve_{request_id}"},
-                    {"text": "❌ Rechazar", "callback_data": f"reject_{request_id}"}
-                ],
-                [
-                    {"text": "🗺️ Ver en Maps", "url": maps_url},
-                    {"text": "📋 Copiar coords", "callback_data": f"copy_{request_id}"}
-                ]
-            ]
-        }
+        # Mensaje y botones (plantilla precompilada del país; campos escapados)
+        message = messages.country(
+            pais, 'new_request',
+            name=location['name'], coords=location['coords'], type=location['type'],
+            detected=location['detected'], request_id=request_id
+        )
+        keyboard = request_keyboard(request_id, maps_url)
         
         # Enviar a Telegram
         print(f"📤 Enviando a Telegram (chat: {chat_id})...")
@@ -449,30 +480,53 @@ def send_notification():
         traceback.print_exc()
         return jsonify({"error": f"Error interno: {str(e)}"}), 500
 
+@app.route('/tiles/<int:z>/<int:x>/<int:y>')
+def map_tile(z, x, y):
+    """Clusters de ubicaciones aprobadas para un tile de mapa (Web Mercator)"""
+    pais = request.args.get('pais', '').upper()
+    if pais and pais not in COUNTRIES:
+        return jsonify({"error": f"País no soportado: {pais}"}), 400
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        return jsonify({"error": "Tile fuera de rango"}), 400
+    
+    # Tomar el snapshot una sola vez: la respuesta es consistente aunque se recargue
+    snapshot = locations.current
+    index = snapshot.indexes.get('tiles')
+    if index is None:
+        return jsonify({"error": "Índice de tiles no disponible"}), 503
+    
+    etag = f"{snapshot.sha or int(snapshot.loaded_at)}-{pais or 'ALL'}-{z}-{x}-{y}"
+    if request.if_none_match.contains(etag):
+        return '', 304
+    
+    body = index.render([pais] if pais else list(COUNTRIES), z, x, y)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
 @app.route('/approve/<request_id>', methods=['GET'])
 def approve_route(request_id):
     """Ruta para aprobar desde enlace web (fallback)"""
     print(f"🌐 Aprobando desde URL: {request_id}")
     
     try:
-        if request_id in pending_requests:
-            data = pending_requests[request_id]
-            pais = data['pais']
+        # Reclamar la solicitud (evita aprobaciones dobles entre workers)
+        data = pending_requests.pop(request_id)
+        if data:
+            pais = data.pais
             country = COUNTRIES.get(pais, {})
             
-            # Actualizar GitHub
-            success = update_github_file(data['location'])
+            # Guardar ubicación
+            success = save_location(data.location)
             
             if success:
                 # Notificar por Telegram
                 send_telegram_message(
-                    data['chat_id'], 
-                    f"✅ *{data['location'].get('name', 'Ubicación')}* aprobada en {country.get('name', 'el país')}!"
+                    data.chat_id,
+                    messages.country(pais, 'approved_web', name=data.name)
                 )
                 
-                # Eliminar de pendientes
-                del pending_requests[request_id]
-                
                 # Página de éxito
                 return f"""
                 <html>
@@ -514,7 +568,7 @@ def approve_route(request_id):
                         <h1>¡Ubicación Aprobada!</h1>
                         <p>La ubicación ha sido agregada exitosamente a la base de datos.</p>
                         <p><strong>País:</strong> {country.get('name', 'N/A')}</p>
-                        <p><strong>Nombre:</strong> {data['location'].get('name', 'Sin nombre')}</p>
+                        <p><strong>Nombre:</strong> {data.name}</p>
                         <p><small>ID: {request_id}</small></p>
                         <a href="/" class="btn">Volver al inicio</a>
                     </div>
@@ -522,7 +576,8 @@ def approve_route(request_id):
                 </html>
                 """
             else:
-                return "❌ Error al actualizar GitHub", 500
+                pending_requests[request_id] = data
+                return "❌ Error al guardar la ubicación", 500
         
         return """
         <html>
@@ -551,70 +606,51 @@ def handle_text_command(chat_id, message, action):
                 request_id = req_id
                 break
         
-        if request_id and request_id in pending_requests:
-            data = pending_requests[request_id]
-            
+        data = pending_requests.pop(request_id) if request_id else None
+        if data:
             if action == 'approve':
-                success = update_github_file(data['location'])
+                success = save_location(data.location)
                 if success:
-                    send_telegram_message(
-                        chat_id, 
-                        f"✅ *{data['location'].get('name', 'Ubicación')}* aprobada exitosamente."
-                    )
-                    del pending_requests[request_id]
+                    send_telegram_message(chat_id, messages.text('text_approved', name=data.name))
                 else:
-                    send_telegram_message(chat_id, "❌ Error al actualizar GitHub")
+                    pending_requests[request_id] = data
+                    send_telegram_message(chat_id, messages.text('save_error'))
             else:  # reject
-                send_telegram_message(
-                    chat_id, 
-                    f"❌ *{data['location'].get('name', 'Ubicación')}* rechazada."
-                )
-                del pending_requests[request_id]
+                send_telegram_message(chat_id, messages.text('text_rejected', name=data.name))
         else:
-            send_telegram_message(chat_id, "📭 No se encontró la solicitud")
+            send_telegram_message(chat_id, messages.text('text_not_found'))
             
     except Exception as e:
         print(f"❌ Error en handle_text_command: {str(e)}")
-        send_telegram_message(chat_id, "❌ Error procesando el comando")
+        send_telegram_message(chat_id, messages.text('command_error'))
 
 def handle_button_approval(request_id, chat_id, message_id):
     """Manejar aprobación desde botón inline"""
     print(f"🔄 Aprobando desde botón: {request_id}")
     
     try:
-        if request_id in pending_requests:
-            data = pending_requests[request_id]
-            pais = data['pais']
-            country = COUNTRIES.get(pais, {})
+        data = pending_requests.pop(request_id)
+        if data:
+            pais = data.pais
             
-            # Actualizar GitHub
-            success = update_github_file(data['location'])
+            # Guardar ubicación
+            success = save_location(data.location)
             
             if success:
                 # Editar mensaje original
                 edit_telegram_message(
                     chat_id, 
                     message_id,
-                    f"✅ *APROBADO - {country.get('emoji', '')} {country.get('name', '')}*\n\n"
-                    f"*{data['location'].get('name', 'Ubicación')}* ha sido agregada exitosamente."
+                    messages.country(pais, 'approved', name=data.name)
                 )
-                
-                # Eliminar de pendientes
-                del pending_requests[request_id]
                 print(f"✅ Solicitud {request_id} aprobada")
             else:
-                edit_telegram_message(
-                    chat_id, 
-                    message_id,
-                    "❌ Error al actualizar GitHub"
-                )
-                print(f"❌ Error actualizando GitHub para {request_id}")
+                # Devolver a pendientes para poder reintentar
+                pending_requests[request_id] = data
+                edit_telegram_message(chat_id, message_id, messages.text('save_error'))
+                print(f"❌ Error guardando ubicación para {request_id}")
         else:
-            edit_telegram_message(
-                chat_id, 
-                message_id,
-                "❌ Solicitud no encontrada"
-            )
+            edit_telegram_message(chat_id, message_id, messages.text('not_found'))
             print(f"⚠️ Solicitud {request_id} no encontrada")
             
     except Exception as e:
@@ -625,28 +661,19 @@ def handle_button_rejection(request_id, chat_id, message_id):
     print(f"🔄 Rechazando desde botón: {request_id}")
     
     try:
-        if request_id in pending_requests:
-            data = pending_requests[request_id]
-            pais = data['pais']
-            country = COUNTRIES.get(pais, {})
+        data = pending_requests.pop(request_id)
+        if data:
+            pais = data.pais
             
             # Editar mensaje original
             edit_telegram_message(
                 chat_id, 
                 message_id,
-                f"❌ *RECHAZADO - {country.get('emoji', '')} {country.get('name', '')}*\n\n"
-                f"*{data['location'].get('name', 'Ubicación')}* ha sido rechazada."
+                messages.country(pais, 'rejected', name=data.name)
             )
-            
-            # Eliminar de pendientes
-            del pending_requests[request_id]
             print(f"❌ Solicitud {request_id} rechazada")
         else:
-            edit_telegram_message(
-                chat_id, 
-                message_id,
-                "❌ Solicitud no encontrada"
-            )
+            edit_telegram_message(chat_id, message_id, messages.text('not_found'))
             
     except Exception as e:
         print(f"❌ Error en handle_button_rejection: {str(e)}")
@@ -656,9 +683,9 @@ def handle_copy_coords(request_id, callback_id):
     print(f"📋 Copiando coordenadas: {request_id}")
     
     try:
-        if request_id in pending_requests:
-            data = pending_requests[request_id]
-            coords = data['location'].get('coords', '')
+        data = pending_requests.get(request_id)
+        if data:
+            coords = data.coords
             
             answer_callback_query(
                 callback_id, 
@@ -681,146 +708,108 @@ def show_pending_requests(chat_id):
     try:
         user_requests = [
             (req_id, data) for req_id, data in pending_requests.items() 
-            if data['chat_id'] == chat_id
+            if str(data.chat_id) == chat_id
         ]
         
         if not user_requests:
-            send_telegram_message(chat_id, "📭 No hay solicitudes pendientes.")
+            send_telegram_message(chat_id, messages.text('no_pending'))
             return
         
-        message = "📋 *Solicitudes Pendientes:*\n\n"
+        lines = [
+            messages.country(
+                data.pais, 'pending_line',
+                name=data.name, request_id=req_id, coords=data.coords, time=data.timestamp[11:16]
+            )
+            for req_id, data in user_requests
+        ]
         
-        for req_id, data in user_requests:
-            loc = data['location']
-            pais = data.get('pais', 'HN')
-            country = COUNTRIES.get(pais, {})
-            
-            message += f"{country.get('emoji', '📍')} *{loc.get('name', 'Sin nombre')}*\n"
-            message += f"   🆔: `{req_id}`\n"
-            message += f"   📍: `{loc.get('coords', '')}`\n"
-            message += f"   🕒: {data['timestamp'][11:16]}\n\n"
+        # Botones para aprobar todo lo visible (solo hasta la solicitud más reciente listada)
+        until_ms = math.ceil(max(data.created for _, data in user_requests) * 1000)
+        by_country = {}
+        for _, data in user_requests:
+            by_country[data.pais] = by_country.get(data.pais, 0) + 1
+        keyboard = pending_keyboard(len(user_requests), until_ms, by_country, COUNTRIES)
         
-        send_telegram_message(chat_id, message)
+        # Listas largas se parten en varios mensajes; los botones van en el último
+        send_telegram_chunks(chat_id, chunk_lines(lines, header=messages.text('pending_header')), keyboard)
     except Exception as e:
         print(f"❌ Error en show_pending_requests: {str(e)}")
-        send_telegram_message(chat_id, "❌ Error mostrando solicitudes")
+        send_telegram_message(chat_id, messages.text('pending_error'))
+
+def collect_pending_ids(chat_id, pais=None, until=None):
+    """IDs pendientes de un chat, opcionalmente por país y hasta cierta hora"""
+    return [
+        req_id for req_id, data in pending_requests.items()
+        if str(data.chat_id) == chat_id
+        and (pais is None or data.pais == pais)
+        and (until is None or data.created <= until)
+    ]
 
-def update_github_file(location):
-    """Actualizar archivo en GitHub - VERSIÓN SIMPLIFICADA"""
-    print(f"🔄 Actualizando GitHub: {location.get('name', 'Sin nombre')}")
+def handle_batch_command(chat_id, action, request_ids, message_id=None):
+    """Aprobar/rechazar varias solicitudes: se reclaman juntas y se guardan en una escritura"""
+    print(f"📦 Lote {action}: {len(request_ids)} solicitudes")
+    
+    def reply(text, *more):
+        # Con botón se edita el mensaje de /lista; el resto de partes va aparte
+        if message_id:
+            edit_telegram_message(chat_id, message_id, text)
+        else:
+            send_telegram_message(chat_id, text)
+        for chunk in more:
+            send_telegram_message(chat_id, chunk)
     
     try:
-        if not GITHUB_TOKEN:
-            print("❌ GitHub Token no configurado")
-            return False
-        
-        pais = location.get('pais', 'HN')
-        country = COUNTRIES.get(pais, {})
-        
-        url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE}"
-        headers = {
-            "Authorization": f"token {GITHUB_TOKEN}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        
-        print(f"📥 Obteniendo archivo: {url}")
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        if response.status_code != 200:
-            print(f"❌ Error obteniendo archivo: {response.status_code}")
-            return False
-        
-        file_data = response.json()
-        
-        # Decodificar contenido
-        current_content = base64.b64decode(file_data['content']).decode('utf-8')
-        current_json = json.loads(current_content) if current_content.strip() else {}
-        
-        # Inicializar estructura por países si no existe
-        for country_code in COUNTRIES:
-            if country_code not in current_json:
-                current_json[country_code] = {}
-        
-        if pais not in current_json:
-            current_json[pais] = {}
-        
-        print(f"📄 País: {pais} | Entradas: {len(current_json[pais])}")
-        
-        # Crear clave única basada en nombre
-        name = location.get('name', 'Ubicación sin nombre')
-        key = name.lower()\
-            .replace(' ', '_')\
-            .replace('ñ', 'n')\
-            .replace('á', 'a')\
-            .replace('é', 'e')\
-            .replace('í', 'i')\
-            .replace('ó', 'o')\
-            .replace('ú', 'u')\
-            .replace('.', '')\
-            .replace(',', '')\
-            .replace("'", '')\
-            .replace('"', '')\
-            .strip('_')
-        
-        # Si la clave ya existe, agregar sufijo
-        original_key = key
-        counter = 1
-        while key in current_json[pais]:
-            key = f"{original_key}_{counter}"
-            counter += 1
-        
-        print(f"🔑 Clave generada: {key}")
-        
-        # Parsear coordenadas
-        try:
-            coords = location['coords'].split(',')
-            lat = float(coords[0].strip())
-            lon = float(coords[1].strip())
-        except Exception as e:
-            print(f"❌ Error parseando coordenadas: {e}")
-            lat = 0.0
-            lon = 0.0
-        
-        # **ESTRUCTURA SIMPLIFICADA - SOLO DATOS BÁSICOS**
-        current_json[pais][key] = {
-            "name": name,
-            "lat": lat,
-            "lon": lon,
-            "pais": pais,
-            "type": location.get('type', 'colonia'),
-            "added": datetime.now().isoformat(),
-            "approved": True,
-            "source": "user_submission",
-            "detected_automatically": True,
-            "full_address": location.get('detected', 'No detectado automáticamente')
-        }
-        
-        # **ELIMINADO: Campos específicos por país**
-        # Solo mantenemos la estructura básica
-        
-        # Subir cambios
-        new_content = json.dumps(current_json, indent=2, ensure_ascii=False)
-        new_content_b64 = base64.b64encode(new_content.encode('utf-8')).decode('utf-8')
-        
-        print(f"📤 Subiendo cambios a GitHub...")
+        claimed = pending_requests.pop_many(request_ids)
+        if not claimed:
+            reply(messages.text('batch_empty'))
+            return
         
-        update_response = requests.put(url, headers=headers, json={
-            "message": f"📍 Agregar en {country.get('name', pais)}: {name}",
-            "content": new_content_b64,
-            "sha": file_data['sha']
-        }, timeout=30)
+        if action == 'approve':
+            try:
+                storage.apply_batch([data.location for data in claimed.values()])
+            except Exception as e:
+                # Devolver todas a pendientes: el lote es todo o nada
+                for req_id, data in claimed.items():
+                    pending_requests[req_id] = data
+                print(f"❌ Error guardando lote: {str(e)}")
+                reply(messages.text('batch_save_error', count=len(claimed)))
+                return
+            locations.request_refresh()
+            header = messages.text('batch_approved', count=len(claimed))
+        else:
+            header = messages.text('batch_rejected', count=len(claimed))
         
-        print(f"📨 Respuesta GitHub: {update_response.status_code}")
+        lines = [
+            messages.country(data.pais, 'batch_line', name=data.name)
+            for data in claimed.values()
+        ]
+        if len(lines) > 30:
+            lines = lines[:30] + [messages.text('batch_more', count=len(lines) - 30)]
         
-        if update_response.status_code == 200:
-            print("✅ GitHub actualizado exitosamente")
-            return True
-        else:
-            print(f"❌ Error GitHub: {update_response.text[:200]}")
-            return False
+        missing = len(set(request_ids)) - len(claimed)
+        footer = messages.text('batch_missing', count=missing) if missing else ''
+        reply(*chunk_lines(lines, header=header, footer=footer))
+        print(f"✅ Lote {action} completado: {len(claimed)}")
         
     except Exception as e:
-        print(f"❌ Error en update_github_file: {str(e)}")
+        print(f"❌ Error en handle_batch_command: {str(e)}")
+        traceback.print_exc()
+        reply(messages.text('batch_error'))
+
+def save_location(location):
+    """Guardar ubicación aprobada en el backend configurado"""
+    print(f"🔄 Guardando ({storage.name}): {location.get('name', 'Sin nombre')}")
+    
+    try:
+        keys = storage.apply_batch([location])
+        print(f"🔑 Clave generada: {keys[0]}")
+        locations.request_refresh()
+        return True
+    except StorageError as e:
+        print(f"❌ {e}")
+        return False
+    except Exception as e:
+        print(f"❌ Error en save_location: {str(e)}")
         traceback.print_exc()
         return False
 
@@ -836,7 +825,7 @@ def send_telegram_message(chat_id, text, reply_markup=None):
         data = {
             "chat_id": chat_id,
             "text": text,
-            "parse_mode": "Markdown",
+            "parse_mode": "MarkdownV2",
             "disable_web_page_preview": True
         }
         
@@ -844,7 +833,8 @@ def send_telegram_message(chat_id, text, reply_markup=None):
             data["reply_markup"] = reply_markup
         
         print(f"📤 Enviando a Telegram...")
-        response = requests.post(url, json=data, timeout=30)
+        with span('telegram.sendMessage'):
+            response = requests.post(url, json=data, timeout=30)
         
         print(f"📨 Status: {response.status_code}")
         
@@ -857,6 +847,14 @@ def send_telegram_message(chat_id, text, reply_markup=None):
         print(f"❌ Error en send_telegram_message: {str(e)}")
         return False
 
+def send_telegram_chunks(chat_id, chunks, reply_markup=None):
+    """Enviar un mensaje partido en varios; los botones van en el último"""
+    success = True
+    for i, chunk in enumerate(chunks):
+        last = i == len(chunks) - 1
+        success = send_telegram_message(chat_id, chunk, reply_markup if last else None) and success
+    return success
+
 def edit_telegram_message(chat_id, message_id, new_text):
     """Editar mensaje existente en Telegram"""
     try:
@@ -869,10 +867,11 @@ def edit_telegram_message(chat_id, message_id, new_text):
             "chat_id": chat_id,
             "message_id": message_id,
             "text": new_text,
-            "parse_mode": "Markdown"
+            "parse_mode": "MarkdownV2"
         }
         
-        response = requests.post(url, json=data, timeout=30)
+        with span('telegram.editMessageText'):
+            response = requests.post(url, json=data, timeout=30)
         return response.status_code == 200
         
     except Exception as e:
@@ -895,7 +894,8 @@ def answer_callback_query(callback_id, text=None, show_alert=False):
         if text:
             data["text"] = text
         
-        response = requests.post(url, json=data, timeout=5)
+        with span('telegram.answerCallbackQuery'):
+            response = requests.post(url, json=data, timeout=5)
         return response.status_code == 200
         
     except Exception as e:
@@ -921,6 +921,60 @@ def handle_exception(error):
     return jsonify({"error": "Error interno del servidor"}), 500
 
 # ========== INICIALIZACIÓN ==========
+def warmup(reload=False):
+    """Cargar datos inmutables una sola vez.
+    
+    Con gunicorn --preload se ejecuta en el master antes del fork, así los
+    workers comparten estos objetos (copy-on-write). En SIGHUP se vuelve a
+    llamar desde el hook on_reload antes de crear los workers nuevos.
+    """
+    get_hn_municipalities(reload=reload)
+    snapshot = locations.load()
+    
+    print(f"🔥 Warmup completo (pid {os.getpid()}): {snapshot.count(COUNTRIES)} ubicaciones en snapshot")
+
+def send_expiry_reminders():
+    """Avisar a cada chat, en un solo mensaje, qué solicitudes están por expirar"""
+    by_chat = {}
+    for req_id, data in pending_requests.claim_reminders():
+        by_chat.setdefault(data.chat_id, []).append((req_id, data))
+
+    now = time.time()
+    for chat_id, items in by_chat.items():
+        lines = [
+            messages.country(
+                data.pais, 'reminder_line', request_id=req_id, name=data.name,
+                hours=max(0, (data.created + PENDING_TTL_HOURS * 3600 - now) / 3600)
+            )
+            for req_id, data in items
+        ]
+        send_telegram_chunks(chat_id, chunk_lines(
+            lines,
+            header=messages.text('reminder_header', count=len(items)),
+            footer=messages.text('reminder_footer')
+        ))
+    return sum(len(items) for items in by_chat.values())
+
+def pending_maintenance_loop():
+    """Expirar solicitudes vencidas y enviar recordatorios periódicamente"""
+    while True:
+        time.sleep(PENDING_SWEEP_INTERVAL)
+        try:
+            expired = pending_requests.expire()
+            reminded = send_expiry_reminders()
+            if expired or reminded:
+                print(f"🧹 Pendientes: {expired} expiradas, {reminded} recordatorios")
+        except Exception as e:
+            print(f"⚠️ Error en mantenimiento de pendientes: {e}")
+
+def start_background_tasks():
+    """Hilos en segundo plano; se inician en cada worker después del fork"""
+    locations.start()
+    threading.Thread(target=pending_maintenance_loop, name='pending-maintenance', daemon=True).start()
+    tracing.start_continuous_profiler()
+
+warmup()
+
 if __name__ == '__main__':
     app_start_time = time.time()
     
@@ -928,10 +982,11 @@ if __name__ == '__main__':
     print("🚀 Sistema de Direcciones Centroamérica")
     print("=" * 60)
     print(f"📅 Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"🌎 Países: {', '.join([f'{c["emoji"]} {c["name"]}' for c in COUNTRIES.values()])}")
+    print(f"🌎 Países: {', '.join([c['emoji'] + ' ' + c['name'] for c in COUNTRIES.values()])}")
     print(f"🔧 Puerto: {PORT}")
     print(f"🤖 Telegram Token: {'✅ CONFIGURADO' if TELEGRAM_TOKEN else '❌ NO CONFIGURADO'}")
     print(f"🐙 GitHub Token: {'✅ CONFIGURADO' if GITHUB_TOKEN else '❌ NO CONFIGURADO'}")
+    print(f"💾 Almacenamiento: {storage.name}")
     print(f"📁 Repositorio: {GITHUB_REPO}")
     print(f"📄 Archivo datos: {GITHUB_FILE}")
     print("=" * 60)
@@ -943,7 +998,8 @@ if __name__ == '__main__':
     
     if not GITHUB_TOKEN:
         print("⚠️ ADVERTENCIA: GITHUB_TOKEN no está configurado")
-        print("⚠️ No se podrán guardar ubicaciones en GitHub")
+        print(f"⚠️ Las ubicaciones se guardarán localmente en {LOCATIONS_FILE}")
     
     # Iniciar servidor
+    start_background_tasks()
     app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
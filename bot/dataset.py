@@ -0,0 +1,451 @@
+"""Importación/exportación masiva del archivo de ubicaciones (sin Telegram ni GitHub)
+
+Ejemplos:
+    python dataset.py import nuevas.csv ../hnd_admin_boundaries.xlsx -o ../locations.json
+    python dataset.py import lugares.ndjson --pais SV --dedupe-meters 100
+    python dataset.py export --format geojson --pais HN -o hn.geojson
+
+Pensado para construir el archivo sin conexión: si el servidor usa el backend
+local sobre el mismo archivo, detenerlo durante la importación.
+"""
+import os
+import sys
+import csv
+import json
+import math
+import re
+import time
+import argparse
+import tempfile
+from datetime import datetime
+from json.encoder import encode_basestring
+
+from geo import LocationError, validate_location, iter_xlsx_rows
+from jsonstream import SpliceError, encode_entry, iter_entries
+from keys import KeyIndex, slugify
+from storage import build_entry
+
+# Misma configuración de países que el servidor (app.py importa Flask, aquí no)
+COUNTRIES = {
+    'HN': {'name': 'Honduras'},
+    'SV': {'name': 'El Salvador'},
+    'CR': {'name': 'Costa Rica'},
+    'PA': {'name': 'Panamá'}
+}
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'locations.json')
+
+# Alias de columnas aceptados en CSV/NDJSON/GeoJSON
+FIELD_ALIASES = {
+    'name': ('name', 'nombre', 'featurename_es'),
+    'lat': ('lat', 'latitud', 'latitude', 'y', 'center_lat'),
+    'lon': ('lon', 'lng', 'longitud', 'longitude', 'x', 'center_lon'),
+    'coords': ('coords', 'coordenadas'),
+    'pais': ('pais', 'country', 'iso2'),
+    'type': ('type', 'tipo'),
+    'detected': ('detected', 'full_address', 'direccion')
+}
+
+# Hojas de hnd_admin_boundaries.xlsx que se importan: hoja -> (tipo, columnas de nombre)
+XLSX_SHEETS = {
+    'hnd_admin1': ('departamento', ('adm1_name',)),
+    'hnd_admin2': ('municipio', ('adm2_name', 'adm1_name'))
+}
+
+# Separadores entre features de un arreglo GeoJSON
+_FEATURE_GAP = re.compile(r'[ \t\r\n,]*')
+
+
+def _pick(row, field):
+    for alias in FIELD_ALIASES[field]:
+        value = row.get(alias)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _to_location(row, default_pais):
+    """Fila cruda -> payload 'location' como el que envía el frontend"""
+    lat = _pick(row, 'lat')
+    lon = _pick(row, 'lon')
+    coords = _pick(row, 'coords')
+    if coords is None and lat is not None and lon is not None:
+        coords = (lat, lon)
+    return {
+        'name': _pick(row, 'name'),
+        'coords': coords,
+        'pais': str(_pick(row, 'pais') or default_pais).upper(),
+        'type': _pick(row, 'type'),
+        'detected': _pick(row, 'detected')
+    }
+
+
+# ========== LECTORES ==========
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as fh:
+        yield from csv.DictReader(fh)
+
+
+def read_ndjson(path):
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_geojson(path, chunk_size=1 << 20):
+    """Recorrer features de un GeoJSON sin cargar el archivo completo"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as fh:
+        buffer = ''
+        # Avanzar hasta el inicio del arreglo "features"
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+            marker = buffer.find('"features"')
+            if marker != -1:
+                start = buffer.find('[', marker)
+                if start != -1:
+                    buffer = buffer[start + 1:]
+                    break
+
+        # `pos` avanza sobre el buffer; solo se compacta al leer otro bloque
+        pos = 0
+        while True:
+            pos = _FEATURE_GAP.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            try:
+                feature, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') != 'Point':
+                continue
+            row = dict(feature.get('properties') or {})
+            row['lon'], row['lat'] = geometry['coordinates'][:2]
+            yield row
+
+
+def read_xlsx(path):
+    """Unidades administrativas (centroides) de hnd_admin_boundaries.xlsx"""
+    for sheet, (kind, name_columns) in XLSX_SHEETS.items():
+        for row in iter_xlsx_rows(path, sheet):
+            names = [row.get(column) for column in name_columns if row.get(column)]
+            if not names:
+                continue
+            yield {
+                'name': names[0],
+                'lat': row.get('center_lat'),
+                'lon': row.get('center_lon'),
+                'pais': 'HN',
+                'type': kind,
+                'detected': ', '.join(names + ['Honduras'])
+            }
+
+
+READERS = {
+    '.csv': read_csv,
+    '.ndjson': read_ndjson,
+    '.jsonl': read_ndjson,
+    '.geojson': read_geojson,
+    '.xlsx': read_xlsx
+}
+
+
+# ========== DEDUPLICACIÓN ESPACIAL ==========
+class SpatialDeduper:
+    """Descarta entradas con el mismo nombre normalizado a menos de N metros.
+
+    Rejilla de celdas del tamaño del radio: solo se revisan las 9 vecinas.
+    """
+
+    def __init__(self, meters):
+        self.meters = meters
+        self.cell = meters / 111320.0 if meters > 0 else None
+        self._cells = {}
+
+    def seen(self, pais, name, lat, lon):
+        """True si ya existe un duplicado; si no, registra el punto"""
+        if self.cell is None:
+            return False
+        slug = slugify(name)
+        cx = int(math.floor(lat / self.cell))
+        cy = int(math.floor(lon / self.cell))
+        cos_lat = math.cos(math.radians(lat))
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other_lat, other_lon in self._cells.get((pais, slug, cx + dx, cy + dy), ()):
+                    d_lat = (lat - other_lat) * 111320.0
+                    d_lon = (lon - other_lon) * 111320.0 * cos_lat
+                    if d_lat * d_lat + d_lon * d_lon <= self.meters * self.meters:
+                        return True
+        self._cells.setdefault((pais, slug, cx, cy), []).append((lat, lon))
+        return False
+
+
+# ========== ESCRITURA ==========
+class DatasetWriter:
+    """Escribe el archivo final en una pasada usando un temporal por país.
+
+    En memoria solo quedan el índice de claves y la rejilla de deduplicación;
+    los registros van directo a disco como fragmentos JSON ya serializados.
+    """
+
+    def __init__(self, output, indent=2, index_path=None, index_cell=0.1):
+        self.output = output
+        self.indent = indent
+        self.index_path = index_path
+        self.index_cell = index_cell
+        self.keys = KeyIndex()
+        self.counts = dict.fromkeys(COUNTRIES, 0)
+        self.grid = {pais: {} for pais in COUNTRIES}
+        self._tmpdir = tempfile.mkdtemp(prefix='dataset_', dir=os.path.dirname(os.path.abspath(output)))
+        self._spills = {
+            pais: open(os.path.join(self._tmpdir, f'{pais}.part'), 'w', encoding='utf-8')
+            for pais in COUNTRIES
+        }
+
+    def add(self, pais, key, entry):
+        if self.counts[pais]:
+            self._spills[pais].write(',\n' if self.indent else ',')
+        value = encode_entry(entry, self.indent, 2)
+        if self.indent:
+            pad = ' ' * (self.indent * 2)
+            self._spills[pais].write(f'{pad}{encode_basestring(key)}: {value}')
+        else:
+            self._spills[pais].write(f'{encode_basestring(key)}:{value}')
+        self.counts[pais] += 1
+
+        if self.index_path:
+            cell = f"{math.floor(entry['lat'] / self.index_cell)}:{math.floor(entry['lon'] / self.index_cell)}"
+            self.grid[pais].setdefault(cell, []).append(key)
+
+    def finish(self):
+        """Unir los temporales en el archivo final (reemplazo atómico)"""
+        for spill in self._spills.values():
+            spill.close()
+
+        tmp_output = os.path.join(self._tmpdir, 'output.json')
+        newline = '\n' if self.indent else ''
+        pad = ' ' * (self.indent or 0)
+        with open(tmp_output, 'w', encoding='utf-8') as out:
+            out.write('{' + newline)
+            for i, pais in enumerate(COUNTRIES):
+                out.write(f'{pad}"{pais}":' + (' {' if self.indent else '{'))
+                if self.counts[pais]:
+                    out.write(newline)
+                    with open(os.path.join(self._tmpdir, f'{pais}.part'), encoding='utf-8') as part:
+                        while True:
+                            block = part.read(1 << 20)
+                            if not block:
+                                break
+                            out.write(block)
+                    out.write(newline + pad)
+                out.write('}' + (',' if i < len(COUNTRIES) - 1 else '') + newline)
+            out.write('}')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_output, self.output)
+
+        if self.index_path:
+            with open(self.index_path, 'w', encoding='utf-8') as fh:
+                json.dump({
+                    'cell_degrees': self.index_cell,
+                    'counts': self.counts,
+                    'grid': self.grid
+                }, fh, ensure_ascii=False, separators=(',', ':'))
+
+        self.cleanup()
+
+    def cleanup(self):
+        for spill in self._spills.values():
+            spill.close()
+        for name in os.listdir(self._tmpdir):
+            os.remove(os.path.join(self._tmpdir, name))
+        os.rmdir(self._tmpdir)
+
+
+def iter_existing(path):
+    """Entradas ya existentes en el archivo base (incluye el journal local).
+
+    El archivo se recorre en streaming (jsonstream.iter_entries); solo el
+    journal, acotado por los checkpoints del servidor, se carga entero.
+    """
+    journal = {}
+    journal_path = path + '.journal'
+    if os.path.exists(journal_path):
+        with open(journal_path, encoding='utf-8') as fh:
+            for line in fh:
+                if line.endswith('\n') and line.strip():
+                    record = json.loads(line)
+                    # La primera línea puede describir el último checkpoint
+                    if 'checkpoint' not in record:
+                        journal[(record['pais'], record['key'])] = record['entry']
+
+    if os.path.exists(path):
+        yielded = 0
+        try:
+            with open(path, 'rb') as fh:
+                for pais, key, entry in iter_entries(fh):
+                    yield pais, key, journal.pop((pais, key), entry)
+                    yielded += 1
+        except SpliceError as e:
+            # Formato distinto de indent=2: carga completa, sin repetir lo ya entregado
+            print(f"⚠️ {e}; se carga {path} completo en memoria", file=sys.stderr)
+            with open(path, encoding='utf-8') as fh:
+                content = fh.read()
+            data = json.loads(content) if content.strip() else {}
+            del content
+            position = 0
+            for pais, entries in data.items():
+                for key, entry in entries.items():
+                    position += 1
+                    if position > yielded:
+                        yield pais, key, journal.pop((pais, key), entry)
+
+    for (pais, key), entry in journal.items():
+        yield pais, key, entry
+
+
+def cmd_import(args):
+    started = time.time()
+    output = args.output
+    writer = DatasetWriter(output, indent=args.indent, index_path=args.index)
+    deduper = SpatialDeduper(args.dedupe_meters)
+    stats = {'leidas': 0, 'importadas': 0, 'duplicadas': 0, 'invalidas': 0}
+
+    try:
+        # 1. Mantener lo que ya existe (mismo criterio de claves que el servidor)
+        if not args.replace:
+            for pais, key, entry in iter_existing(output):
+                if pais not in COUNTRIES:
+                    continue
+                writer.keys.load(pais, (key,))
+                try:
+                    deduper.seen(pais, entry.get('name', ''), float(entry['lat']), float(entry['lon']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+                writer.add(pais, key, entry)
+
+        # 2. Entradas nuevas, en streaming
+        added = datetime.now().isoformat()
+        for path in args.inputs:
+            reader = READERS.get(os.path.splitext(path)[1].lower())
+            if reader is None:
+                raise SystemExit(f"❌ Formato no soportado: {path}")
+            source = f"import:{os.path.basename(path)}"
+            print(f"📥 Leyendo {path}...", file=sys.stderr)
+
+            for row in reader(path):
+                stats['leidas'] += 1
+                try:
+                    location = validate_location(_to_location(row, args.pais), COUNTRIES)
+                except LocationError as e:
+                    stats['invalidas'] += 1
+                    if args.verbose:
+                        print(f"⚠️ Fila {stats['leidas']} descartada: {e}", file=sys.stderr)
+                    continue
+
+                pais, name, entry = build_entry(location)
+                if deduper.seen(pais, name, entry['lat'], entry['lon']):
+                    stats['duplicadas'] += 1
+                    continue
+
+                entry['added'] = added
+                entry['source'] = source
+                entry['detected_automatically'] = False
+                writer.add(pais, writer.keys.allocate(pais, name), entry)
+                stats['importadas'] += 1
+
+        writer.finish()
+    except BaseException:
+        writer.cleanup()
+        raise
+
+    # El journal ya quedó incorporado al archivo
+    journal = output + '.journal'
+    if os.path.exists(journal):
+        open(journal, 'w').close()
+
+    print(
+        f"✅ {output}: {stats['importadas']} importadas, {stats['duplicadas']} duplicadas, "
+        f"{stats['invalidas']} inválidas de {stats['leidas']} filas "
+        f"({sum(writer.counts.values())} en total, {time.time() - started:.1f}s)",
+        file=sys.stderr
+    )
+
+
+def cmd_export(args):
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    countries = [args.pais] if args.pais else list(COUNTRIES)
+    try:
+        rows = (
+            (pais, key, entry) for pais, key, entry in iter_existing(args.source)
+            if pais in countries
+        )
+        if args.format == 'ndjson':
+            for pais, key, entry in rows:
+                out.write(json.dumps(dict(entry, key=key, pais=pais), ensure_ascii=False) + '\n')
+        elif args.format == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(['key', 'name', 'lat', 'lon', 'pais', 'type', 'full_address'])
+            for pais, key, entry in rows:
+                writer.writerow([key, entry.get('name'), entry.get('lat'), entry.get('lon'),
+                                 pais, entry.get('type'), entry.get('full_address')])
+        else:
+            out.write('{"type": "FeatureCollection", "features": [\n')
+            first = True
+            for pais, key, entry in rows:
+                properties = {k: v for k, v in entry.items() if k not in ('lat', 'lon')}
+                properties.update(key=key, pais=pais)
+                feature = {
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [entry['lon'], entry['lat']]},
+                    'properties': properties
+                }
+                out.write(('' if first else ',\n') + json.dumps(feature, ensure_ascii=False))
+                first = False
+            out.write('\n]}\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importar/exportar ubicaciones en lote")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    imp = sub.add_parser('import', help="Importar CSV/GeoJSON/NDJSON/XLSX")
+    imp.add_argument('inputs', nargs='+', help="Archivos de entrada (.csv, .ndjson, .geojson, .xlsx)")
+    imp.add_argument('-o', '--output', default=DEFAULT_OUTPUT, help="Archivo de datos a escribir")
+    imp.add_argument('--pais', default='HN', choices=list(COUNTRIES), help="País si la fila no lo indica")
+    imp.add_argument('--dedupe-meters', type=float, default=50.0,
+                     help="Distancia para considerar duplicado un mismo nombre (0 = desactivar)")
+    imp.add_argument('--replace', action='store_true', help="No conservar el contenido actual")
+    imp.add_argument('--index', help="Escribir también un índice espacial por celdas")
+    imp.add_argument('--indent', type=int, default=2, help="Indentación del JSON (0 = compacto)")
+    imp.add_argument('-v', '--verbose', action='store_true')
+    imp.set_defaults(func=cmd_import)
+
+    exp = sub.add_parser('export', help="Exportar el archivo de datos")
+    exp.add_argument('--source', default=DEFAULT_OUTPUT, help="Archivo de datos a leer")
+    exp.add_argument('--format', choices=('ndjson', 'csv', 'geojson'), default='ndjson')
+    exp.add_argument('--pais', choices=list(COUNTRIES))
+    exp.add_argument('-o', '--output', help="Archivo de salida (por defecto stdout)")
+    exp.set_defaults(func=cmd_export)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""Validación y parseo de coordenadas para las solicitudes de ubicación"""
+import os
+import math
+import zipfile
+import xml.etree.ElementTree as ET
+
+BOUNDARIES_FILE = os.getenv(
+    'BOUNDARIES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hnd_admin_boundaries.xlsx')
+)
+
+# Cajas envolventes por país: (lat_min, lat_max, lon_min, lon_max)
+# Incluyen las islas (Islas del Cisne, Isla del Coco, Coiba...)
+COUNTRY_BOUNDS = {
+    'HN': (12.98, 17.45, -89.36, -83.10),
+    'SV': (13.14, 14.46, -90.14, -87.68),
+    'CR': (5.49, 11.22, -87.12, -82.55),
+    'PA': (7.19, 9.66, -83.06, -77.15)
+}
+
+# Islas y cayos alejados de tierra firme que la aproximación por municipios
+# no cubre: (lat_min, lat_max, lon_min, lon_max)
+HN_ISLANDS = {
+    'Islas del Cisne': (17.35, 17.45, -84.00, -83.85),
+    'Cayos Cochinos': (15.90, 16.02, -86.60, -86.40),
+    'Cayos Vivorillo': (15.78, 15.90, -83.40, -83.20),
+}
+
+# Un municipio se aproxima como círculo de su área; se acepta el punto si cae
+# a menos de HN_RADIUS_FACTOR radios del centroide más cercano
+HN_RADIUS_FACTOR = 1.5
+HN_MIN_RADIUS_KM = 5.0
+
+# Cabeceras de municipios vecinos junto a la frontera: (lat, lon, radio km).
+# Un punto más cerca (en radios) de una de ellas que de cualquier municipio
+# hondureño se rechaza; los círculos solos no distinguen ambos lados.
+HN_NEIGHBORS = {
+    # El Salvador
+    'La Palma': (14.32, -89.17, 8.0),
+    'Citalá': (14.37, -89.21, 6.0),
+    'Chalatenango': (14.03, -88.94, 8.0),
+    'Arcatao': (14.09, -88.75, 6.0),
+    'Perquín': (13.96, -88.16, 6.0),
+    'Polorós': (13.81, -87.81, 6.0),
+    'Concepción de Oriente': (13.80, -87.73, 6.0),
+    'Santa Rosa de Lima': (13.62, -87.89, 8.0),
+    'Pasaquina': (13.58, -87.84, 8.0),
+    'La Unión': (13.34, -87.84, 8.0),
+    # Guatemala
+    'Esquipulas': (14.56, -89.35, 10.0),
+    'Jocotán': (14.82, -89.39, 8.0),
+    'Morales': (15.48, -88.82, 10.0),
+    'Puerto Barrios': (15.73, -88.59, 10.0),
+    # Nicaragua
+    'Somotillo': (13.04, -86.91, 8.0),
+    'Cinco Pinos': (13.23, -86.87, 6.0),
+    'Somoto': (13.48, -86.58, 8.0),
+    'Ocotal': (13.63, -86.47, 8.0),
+    'Dipilto': (13.72, -86.51, 6.0),
+    'San Fernando': (13.68, -86.31, 6.0),
+    'Jalapa': (13.92, -86.12, 8.0),
+    'Murra': (13.76, -86.02, 8.0),
+    'Quilalí': (13.57, -86.03, 8.0),
+    'Wiwilí': (13.62, -85.82, 10.0),
+    'San Andrés de Bocay': (13.98, -85.30, 10.0),
+    'Waspam': (14.74, -83.97, 15.0),
+    'Bilwi': (14.03, -83.39, 10.0),
+}
+
+# Tamaño de celda (grados) de la rejilla que agrupa municipios por zona
+HN_GRID_DEGREES = 0.5
+KM_PER_DEGREE = 111.32
+
+MAX_NAME_LENGTH = 120
+MAX_DETECTED_LENGTH = 300
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_hn_municipalities = None
+_hn_grid = {}
+
+
+class LocationError(ValueError):
+    """Error de validación de una ubicación enviada por el frontend"""
+
+
+def parse_coords(value):
+    """Convertir 'lat, lon' (o [lat, lon]) a una tupla de floats"""
+    if isinstance(value, str):
+        lat, sep, lon = value.partition(',')
+        if not sep:
+            raise LocationError("Formato de coordenadas inválido, se espera 'lat, lon'")
+    elif isinstance(value, (list, tuple)) and len(value) == 2:
+        lat, lon = value
+    else:
+        raise LocationError("Formato de coordenadas inválido, se espera 'lat, lon'")
+
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except (TypeError, ValueError):
+        raise LocationError("Coordenadas no numéricas")
+
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise LocationError("Coordenadas no numéricas")
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        raise LocationError("Coordenadas fuera de rango")
+    return lat, lon
+
+
+def format_coords(lat, lon):
+    """Representación canónica de coordenadas para mensajes y URLs"""
+    return f"{lat:.6f}, {lon:.6f}"
+
+
+def iter_xlsx_rows(path, sheet_name):
+    """Leer una hoja de un .xlsx como diccionarios (sin dependencias externas)"""
+    with zipfile.ZipFile(path) as zf:
+        workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+        rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+
+        sheet_path = None
+        for sheet in workbook.iter(f'{_NS}sheet'):
+            if sheet.get('name') == sheet_name:
+                sheet_path = 'xl/' + targets[sheet.get(f'{_REL_NS}id')].lstrip('/')
+                break
+        if sheet_path is None:
+            raise KeyError(f"Hoja no encontrada: {sheet_name}")
+
+        shared = []
+        if 'xl/sharedStrings.xml' in zf.namelist():
+            with zf.open('xl/sharedStrings.xml') as fh:
+                for _, elem in ET.iterparse(fh):
+                    if elem.tag == f'{_NS}si':
+                        shared.append(''.join(t.text or '' for t in elem.iter(f'{_NS}t')))
+                        elem.clear()
+
+        header = None
+        with zf.open(sheet_path) as fh:
+            for _, elem in ET.iterparse(fh):
+                if elem.tag != f'{_NS}row':
+                    continue
+                cells = {}
+                for cell in elem.iter(f'{_NS}c'):
+                    ref = cell.get('r', '')
+                    column = ref.rstrip('0123456789')
+                    value = cell.findtext(f'{_NS}v')
+                    if value is None:
+                        value = cell.findtext(f'{_NS}is/{_NS}t')
+                    elif cell.get('t') == 's':
+                        value = shared[int(value)]
+                    elif cell.get('t') not in ('str', 'b', 'e'):
+                        value = float(value)
+                    cells[column] = value
+                elem.clear()
+
+                if header is None:
+                    header = cells
+                    continue
+                yield {name: cells.get(column) for column, name in header.items()}
+
+
+def load_hn_municipalities(path=BOUNDARIES_FILE):
+    """Cargar centroides y radio aproximado de los municipios de Honduras"""
+    municipalities = []
+    for row in iter_xlsx_rows(path, 'hnd_admin2'):
+        try:
+            lat = float(row['center_lat'])
+            lon = float(row['center_lon'])
+            area = float(row.get('area_sqkm') or 0.0)
+        except (TypeError, ValueError):
+            continue
+        radius = max(math.sqrt(area / math.pi), HN_MIN_RADIUS_KM) * HN_RADIUS_FACTOR
+        municipalities.append((lat, lon, radius, row.get('adm2_name') or ''))
+    return municipalities
+
+
+def build_hn_grid(municipalities):
+    """Asignar cada municipio a todas las celdas que toca su radio"""
+    grid = {}
+    for municipality in municipalities:
+        m_lat, m_lon, radius, _ = municipality
+        span = radius / KM_PER_DEGREE
+        # El radio en longitud crece con la latitud; 0.95 cubre hasta ~18°
+        lon_span = span / 0.95
+        for cx in range(int(math.floor((m_lat - span) / HN_GRID_DEGREES)),
+                        int(math.floor((m_lat + span) / HN_GRID_DEGREES)) + 1):
+            for cy in range(int(math.floor((m_lon - lon_span) / HN_GRID_DEGREES)),
+                            int(math.floor((m_lon + lon_span) / HN_GRID_DEGREES)) + 1):
+                grid.setdefault((cx, cy), []).append(municipality)
+    return grid
+
+
+def get_hn_municipalities(reload=False):
+    """Índice de municipios de Honduras, cargado una sola vez"""
+    global _hn_municipalities, _hn_grid
+    if _hn_municipalities is None or reload:
+        try:
+            _hn_municipalities = load_hn_municipalities()
+            print(f"🗺️ Límites HN cargados: {len(_hn_municipalities)} municipios")
+        except Exception as e:
+            print(f"⚠️ No se pudieron cargar límites HN ({e}), usando solo caja envolvente")
+            _hn_municipalities = []
+        _hn_grid = build_hn_grid(_hn_municipalities)
+    return _hn_municipalities
+
+
+def find_hn_municipality(lat, lon):
+    """Municipio de Honduras cuyo radio contiene el punto, o None.
+
+    Si una cabecera vecina (HN_NEIGHBORS) queda más cerca, en proporción a
+    su radio, que el mejor municipio, el punto se considera del otro lado.
+    """
+    get_hn_municipalities()
+    cell = (int(math.floor(lat / HN_GRID_DEGREES)), int(math.floor(lon / HN_GRID_DEGREES)))
+    # Aproximación equirectangular: suficiente a escala de municipio
+    cos_lat = math.cos(math.radians(lat))
+
+    def ratio(m_lat, m_lon, radius):
+        dy = (lat - m_lat) * KM_PER_DEGREE
+        dx = (lon - m_lon) * KM_PER_DEGREE * cos_lat
+        return (dx * dx + dy * dy) / (radius * radius)
+
+    best = None
+    best_ratio = 1.0
+    for m_lat, m_lon, radius, name in _hn_grid.get(cell, ()):
+        m_ratio = ratio(m_lat, m_lon, radius)
+        if m_ratio <= best_ratio:
+            best_ratio = m_ratio
+            best = name
+    if best is None:
+        return None
+    for n_lat, n_lon, radius in HN_NEIGHBORS.values():
+        if ratio(n_lat, n_lon, radius * HN_RADIUS_FACTOR) < best_ratio:
+            return None
+    return best
+
+
+def point_in_country(pais, lat, lon):
+    """Verificar que el punto cae dentro del país indicado"""
+    bounds = COUNTRY_BOUNDS.get(pais)
+    if bounds is None:
+        return False
+    lat_min, lat_max, lon_min, lon_max = bounds
+    if not (lat_min <= lat <= lat_max and lon_min <= lon <= lon_max):
+        return False
+    if pais == 'HN' and get_hn_municipalities():
+        if find_hn_municipality(lat, lon) is not None:
+            return True
+        return any(
+            i_lat_min <= lat <= i_lat_max and i_lon_min <= lon <= i_lon_max
+            for i_lat_min, i_lat_max, i_lon_min, i_lon_max in HN_ISLANDS.values()
+        )
+    return True
+
+
+def validate_location(location, countries):
+    """Validar y normalizar el payload 'location' del frontend.
+
+    Devuelve un diccionario nuevo con 'lat' y 'lon' ya convertidos a float,
+    que se pasa tal cual al resto del flujo (Telegram, GitHub).
+    """
+    if not isinstance(location, dict):
+        raise LocationError("Datos de ubicación requeridos")
+
+    if 'coords' not in location:
+        raise LocationError("Coordenadas requeridas")
+
+    pais = location.get('pais', 'HN')
+    if not isinstance(pais, str) or pais not in countries:
+        raise LocationError(f"País no soportado: {pais}")
+
+    name = str(location.get('name') or '').strip() or 'Ubicación sin nombre'
+    if len(name) > MAX_NAME_LENGTH:
+        raise LocationError(f"Nombre demasiado largo (máx. {MAX_NAME_LENGTH})")
+
+    lat, lon = parse_coords(location['coords'])
+    if not point_in_country(pais, lat, lon):
+        raise LocationError(f"Las coordenadas no están dentro de {countries[pais]['name']}")
+
+    detected = str(location.get('detected') or 'No disponible')[:MAX_DETECTED_LENGTH]
+
+    return {
+        'name': name,
+        'coords': format_coords(lat, lon),
+        'lat': lat,
+        'lon': lon,
+        'pais': pais,
+        'type': str(location.get('type') or 'colonia'),
+        'detected': detected
+    }
@@ -0,0 +1,38 @@
+"""Configuración de gunicorn: precarga en el master y recarga con SIGHUP"""
+import os
+import gc
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Importar app.py (y ejecutar warmup) una sola vez en el master
+preload_app = True
+
+# Con varios workers las solicitudes pendientes deben ser compartidas
+os.environ.setdefault('PENDING_DB', '/tmp/direcciones_pending.sqlite3')
+
+
+def when_ready(server):
+    # Mover los objetos precargados a la generación permanente para que el GC
+    # de los workers no los toque y las páginas sigan compartidas. Con el
+    # backend local las aprobaciones se agregan como delta y el snapshot
+    # precargado se conserva; con GitHub cada cambio del archivo hace que
+    # cada worker arme un snapshot completo propio (memoria por worker)
+    # hasta el próximo SIGHUP.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Los hilos no sobreviven al fork: iniciar la recarga del snapshot en cada worker
+    import app
+    app.start_background_tasks()
+
+
+def on_reload(server):
+    # kill -HUP <master>: recargar datos en el master antes de crear workers nuevos
+    import app
+    gc.unfreeze()
+    app.warmup(reload=True)
+    gc.freeze()
@@ -0,0 +1,270 @@
+"""Edición en streaming del archivo de ubicaciones, sin parsearlo completo
+
+Trabaja sobre el formato que escriben el bot y dataset.py (json.dump con
+indent=2): una clave por línea, países con sangría 2 y registros con
+sangría 4. Así agregar registros a un país es copiar el archivo línea por
+línea e insertar texto antes del cierre de su sección. Si el archivo no
+tiene ese formato se lanza SpliceError y se usa el camino de parseo completo.
+"""
+import json
+import math
+from json.decoder import scanstring
+from json.encoder import encode_basestring
+
+from keys import KeyIndex, slugify
+
+INDENT = 2
+_COUNTRY_PREFIX = b'  "'
+_ENTRY_PREFIX = b'    "'
+_SECTION_CLOSE = (b'  }', b'  },')
+_ENTRY_CLOSE = (b'    }', b'    },', b'    ]', b'    ],')
+
+
+class SpliceError(ValueError):
+    """El archivo no tiene el formato esperado para editarlo en streaming"""
+
+
+def _encode_scalar(value):
+    """Codificar un valor JSON simple sin pasar por el JSONEncoder en Python"""
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if value is None:
+        return 'null'
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return repr(value)
+    raise TypeError
+
+
+def encode_entry(entry, indent, level):
+    """Igual que json.dumps(entry, indent=indent) anidado en `level`, más rápido.
+
+    Los registros son planos; si alguno trae valores anidados se usa json.dumps.
+    """
+    try:
+        if not indent:
+            return '{' + ','.join(
+                f'{encode_basestring(k)}:{_encode_scalar(v)}' for k, v in entry.items()
+            ) + '}'
+        pad = ' ' * (indent * (level + 1))
+        return '{\n' + ',\n'.join(
+            f'{pad}{encode_basestring(k)}: {_encode_scalar(v)}' for k, v in entry.items()
+        ) + '\n' + ' ' * (indent * level) + '}'
+    except TypeError:
+        value = json.dumps(entry, ensure_ascii=False, indent=indent or None,
+                           separators=None if indent else (',', ':'))
+        return value.replace('\n', '\n' + ' ' * (indent * level)) if indent else value
+
+
+def _read_key(line, indent):
+    """Clave JSON al inicio de una línea sangrada y el resto de la línea"""
+    text = line.decode('utf-8')
+    try:
+        key, end = scanstring(text, indent + 1)
+    except ValueError as e:
+        raise SpliceError(f"Clave inválida: {e}")
+    return key, text[end:]
+
+
+def _is_candidate(key, bases):
+    """¿Puede `key` chocar con la clave de un nombre nuevo? (base o base_N)"""
+    if key in bases:
+        return True
+    head, _, tail = key.rpartition('_')
+    return tail.isdigit() and head in bases
+
+
+def splice_entries(src, dst, entries):
+    """Copiar `src` a `dst` (archivos binarios) agregando registros por país.
+
+    `entries` es una lista de (pais, nombre, registro) como la de
+    storage.build_entry. Las claves se asignan con un KeyIndex que solo
+    recuerda las claves existentes que podrían chocar, así la memoria no
+    depende del tamaño del archivo. Devuelve las claves en el mismo orden.
+    """
+    pending = {}
+    for i, (pais, name, _) in enumerate(entries):
+        pending.setdefault(pais, []).append(i)
+    bases = {pais: {slugify(entries[i][1]) for i in indexes} for pais, indexes in pending.items()}
+    index = KeyIndex()
+    keys = [None] * len(entries)
+
+    def new_lines(pais):
+        """Registros nuevos de un país ya serializados (asigna sus claves)"""
+        chunks = []
+        for i in pending.pop(pais):
+            _, name, entry = entries[i]
+            keys[i] = index.allocate(pais, name)
+            chunks.append(
+                f'    {encode_basestring(keys[i])}: {encode_entry(entry, INDENT, 2)}'.encode('utf-8')
+            )
+        return b',\n'.join(chunks)
+
+    # La última línea se retiene para poder agregarle una coma
+    held = None
+    write = dst.write
+
+    def emit(line):
+        nonlocal held
+        if held is not None:
+            write(held)
+            write(b'\n')
+        held = line
+
+    lines = iter(src)
+    first_raw = next(lines, b'')
+    first = first_raw.strip()
+    if first == b'{}' or not first:
+        lines = iter((b'}\n' if first_raw.endswith(b'\n') else b'}',))
+    elif first != b'{':
+        raise SpliceError("El archivo no empieza con '{' en su propia línea")
+    emit(b'{')
+
+    section = None
+    closed = False
+    trailing_newline = False
+    for raw in lines:
+        trailing_newline = raw.endswith(b'\n')
+        line = raw.rstrip(b'\r\n')
+        if closed:
+            if line.strip():
+                raise SpliceError("Contenido después del cierre del archivo")
+            continue
+
+        if section is not None:
+            if line.startswith(_ENTRY_PREFIX):
+                if section in bases:
+                    key, _ = _read_key(line, 4)
+                    if _is_candidate(key, bases[section]):
+                        index.load(section, (key,))
+            elif line in _SECTION_CLOSE:
+                if section in pending:
+                    if not held.endswith(b'{'):
+                        held += b','
+                    emit(new_lines(section))
+                section = None
+            emit(line)
+            continue
+
+        if line.startswith(_COUNTRY_PREFIX):
+            pais, rest = _read_key(line, 2)
+            if rest == ': {':
+                section = pais
+            elif rest in (': {}', ': {},'):
+                if pais in pending:
+                    emit(line[:-2 if rest.endswith(',') else -1])
+                    emit(new_lines(pais))
+                    line = b'  },' if rest.endswith(',') else b'  }'
+            else:
+                raise SpliceError(f"Sección de país inesperada: {line[:80]!r}")
+            emit(line)
+        elif line == b'}':
+            # Países que aún no existen en el archivo: secciones nuevas al final
+            for pais in list(pending):
+                if held != b'{':
+                    held += b','
+                emit(f'  {encode_basestring(pais)}: {{'.encode('utf-8'))
+                emit(new_lines(pais))
+                emit(b'  }')
+            emit(line)
+            closed = True
+        elif line.strip():
+            raise SpliceError(f"Línea inesperada fuera de una sección: {line[:80]!r}")
+
+    if not closed or section is not None:
+        raise SpliceError("Archivo incompleto (falta el cierre)")
+    write(held)
+    if trailing_newline:
+        write(b'\n')
+    return keys
+
+
+def iter_entries(src):
+    """Recorrer (pais, clave, registro) de un archivo binario sin cargarlo entero.
+
+    Cada registro se decodifica por separado con json.loads; lanza
+    SpliceError si el archivo no tiene el formato indent=2.
+    """
+    lines = iter(src)
+    first = next(lines, b'').strip()
+    if first in (b'', b'{}'):
+        return
+    if first != b'{':
+        raise SpliceError("El archivo no empieza con '{' en su propia línea")
+
+    section = None
+    key = None
+    body = None
+    for raw in lines:
+        line = raw.rstrip(b'\r\n')
+        if section is None:
+            if line.startswith(_COUNTRY_PREFIX):
+                pais, rest = _read_key(line, 2)
+                if rest == ': {':
+                    section = pais
+                elif rest not in (': {}', ': {},'):
+                    raise SpliceError(f"Sección de país inesperada: {line[:80]!r}")
+            elif line == b'}':
+                return
+            elif line.strip():
+                raise SpliceError(f"Línea inesperada fuera de una sección: {line[:80]!r}")
+            continue
+
+        if body is not None:
+            # El registro termina en la línea de cierre con sangría 4
+            if line in _ENTRY_CLOSE:
+                body.append(line[4:5].decode('ascii'))
+                yield section, key, json.loads('\n'.join(body))
+                body = None
+            else:
+                body.append(line.decode('utf-8'))
+        elif line.startswith(_ENTRY_PREFIX):
+            key, rest = _read_key(line, 4)
+            if not rest.startswith(': '):
+                raise SpliceError(f"Registro inesperado: {line[:80]!r}")
+            value = rest[2:]
+            if value in ('{', '['):
+                body = [value]
+            else:
+                yield section, key, json.loads(value[:-1] if value.endswith(',') else value)
+        elif line in _SECTION_CLOSE:
+            section = None
+        else:
+            raise SpliceError(f"Línea inesperada en {section}: {line[:80]!r}")
+
+    raise SpliceError("Archivo incompleto (falta el cierre)")
+
+
+def write_locations(data, fh):
+    """Igual que json.dump(data, fh, indent=2, ensure_ascii=False), más rápido.
+
+    Los registros se codifican con encode_entry; `fh` es un archivo de texto.
+    """
+    def encode(value, level):
+        if isinstance(value, dict) and value:
+            return encode_entry(value, INDENT, level)
+        text = json.dumps(value, ensure_ascii=False, indent=INDENT)
+        return text.replace('\n', '\n' + ' ' * (INDENT * level))
+
+    write = fh.write
+    if not data:
+        write('{}')
+        return
+    separator = '\n  '
+    write('{')
+    for pais, entries in data.items():
+        write(f'{separator}{encode_basestring(pais)}: ')
+        separator = ',\n  '
+        if not isinstance(entries, dict) or not entries:
+            write(encode(entries, 1))
+            continue
+        write('{')
+        entry_separator = '\n    '
+        for key, entry in entries.items():
+            write(f'{entry_separator}{encode_basestring(key)}: {encode(entry, 2)}')
+            entry_separator = ',\n    '
+        write('\n  }')
+    write('\n}')
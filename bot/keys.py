@@ -0,0 +1,72 @@
+"""Generación de claves para ubicaciones (compatible con normalizeQuery del frontend)"""
+import re
+import unicodedata
+
+DEFAULT_SLUG = 'ubicacion'
+
+# Marcas diacríticas combinantes (U+0300 - U+036F), igual que el frontend
+_STRIP_MARKS = dict.fromkeys(range(0x0300, 0x0370))
+_INVALID_CHARS = re.compile(r'[^a-z0-9\s]')
+_WHITESPACE = re.compile(r'\s+')
+_SUFFIXED = re.compile(r'^(.+)_(\d+)$')
+
+
+def normalize_query(text):
+    """Equivalente a normalizeQuery() de index.html"""
+    text = unicodedata.normalize('NFD', text or '').translate(_STRIP_MARKS).lower()
+    return _INVALID_CHARS.sub('', text).strip()
+
+
+def slugify(name):
+    """Clave base para un nombre: 'Colonia Kennedy' -> 'colonia_kennedy'"""
+    slug = _WHITESPACE.sub('_', normalize_query(name))
+    return slug or DEFAULT_SLUG
+
+
+class KeyIndex:
+    """Índice de claves por país con el siguiente sufijo libre por clave base.
+
+    Evita recorrer 'centro_1', 'centro_2', ... en cada inserción: el contador
+    de cada base solo avanza, así que asignar una clave es O(1) amortizado.
+    """
+
+    def __init__(self, data=None):
+        self._taken = {}
+        self._next_suffix = {}
+        for pais, entries in (data or {}).items():
+            self.load(pais, entries)
+
+    def load(self, pais, keys):
+        """Registrar claves ya existentes de un país"""
+        taken = self._taken.setdefault(pais, set())
+        next_suffix = self._next_suffix.setdefault(pais, {})
+        for key in keys:
+            taken.add(key)
+            match = _SUFFIXED.match(key)
+            if match:
+                base = match.group(1)
+                suffix = int(match.group(2)) + 1
+                if suffix > next_suffix.get(base, 1):
+                    next_suffix[base] = suffix
+
+    def __contains__(self, item):
+        pais, key = item
+        return key in self._taken.get(pais, ())
+
+    def allocate(self, pais, name):
+        """Reservar y devolver una clave libre para el nombre en el país"""
+        taken = self._taken.setdefault(pais, set())
+        base = slugify(name)
+        if base not in taken:
+            taken.add(base)
+            return base
+
+        next_suffix = self._next_suffix.setdefault(pais, {})
+        counter = next_suffix.get(base, 1)
+        key = f"{base}_{counter}"
+        while key in taken:
+            counter += 1
+            key = f"{base}_{counter}"
+        next_suffix[base] = counter + 1
+        taken.add(key)
+        return key
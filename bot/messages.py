@@ -0,0 +1,267 @@
+"""Plantillas precompiladas de mensajes de Telegram (MarkdownV2)
+
+El texto fijo de una plantilla se escribe como Markdown simple: `*negrita*`
+y `` `código` `` son marcas; todo lo demás se escapa una sola vez al
+compilar. Los campos `{nombre}` se escapan al renderizar (dentro de un
+bloque de código solo hace falta escapar ` y \\). `{campo!r}` inserta texto
+que ya es MarkdownV2.
+"""
+from string import Formatter
+
+# Límite de Telegram por mensaje (en unidades UTF-16)
+MAX_MESSAGE_LENGTH = 4096
+
+_SPECIAL = '_*[]()~`>#+-=|{}.!\\'
+_ESCAPE = str.maketrans({c: '\\' + c for c in _SPECIAL})
+_ESCAPE_LITERAL = str.maketrans({c: '\\' + c for c in _SPECIAL if c not in '*`'})
+_ESCAPE_CODE = str.maketrans({'`': '\\`', '\\': '\\\\'})
+
+
+def escape(text):
+    """Escapar texto libre para MarkdownV2"""
+    return str(text).translate(_ESCAPE)
+
+
+def escape_code(text):
+    """Escapar texto que va dentro de `código`"""
+    return str(text).translate(_ESCAPE_CODE)
+
+
+def message_length(text):
+    """Longitud según Telegram (los emoji fuera del BMP cuentan doble)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class Template:
+    """Plantilla compilada: partes fijas ya escapadas y campos por rellenar"""
+    __slots__ = ('parts', 'fields')
+
+    def __init__(self, source, **constants):
+        parts = []
+        in_code = False
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if literal:
+                if in_code:
+                    parts.append(literal.translate(_ESCAPE_CODE).replace('\\`', '`'))
+                else:
+                    parts.append(literal.translate(_ESCAPE_LITERAL))
+                in_code ^= literal.count('`') % 2 == 1
+            if field is None:
+                continue
+            part = (field, spec, 'r' if conversion == 'r' else 'c' if in_code else 'e')
+            if field in constants:
+                parts.append(self._format(part, constants[field]))
+            else:
+                parts.append(part)
+
+        # Unir las partes fijas consecutivas
+        merged = []
+        for part in parts:
+            if isinstance(part, str) and merged and isinstance(merged[-1], str):
+                merged[-1] += part
+            else:
+                merged.append(part)
+        self.parts = tuple(merged)
+        self.fields = tuple(part for part in merged if not isinstance(part, str))
+
+    @staticmethod
+    def _format(part, value):
+        _, spec, mode = part
+        text = format(value, spec) if spec else str(value)
+        if mode == 'r':
+            return text
+        return text.translate(_ESCAPE_CODE if mode == 'c' else _ESCAPE)
+
+    def render(self, **values):
+        if not self.fields:
+            return self.parts[0] if self.parts else ''
+        return ''.join(
+            part if isinstance(part, str) else self._format(part, values[part[0]])
+            for part in self.parts
+        )
+
+
+# Textos del bot por idioma. Las plantillas de COUNTRY_TEMPLATES se
+# precompilan una vez por país con {emoji}, {country} y {COUNTRY} fijos.
+TEMPLATES = {
+    'es': {
+        'start': (
+            "🤖 *Sistema de Aprobación Centroamérica*\n\n"
+            "Recibo solicitudes de nuevas ubicaciones para:\n"
+            "{countries!r}\n\n"
+            "*Comandos disponibles:*\n"
+            "/start - Mostrar este mensaje\n"
+            "/lista - Ver solicitudes pendientes\n"
+            "/aprobar id1 id2 ... - Aprobar varias solicitudes\n"
+            "/aprobar_todo HN - Aprobar todas las pendientes (país opcional)\n"
+            "/rechazar id1 id2 ... - Rechazar varias solicitudes\n"
+            "/paises - Ver países soportados\n"
+            "/ayuda - Mostrar ayuda"
+        ),
+        'help': (
+            "📋 *Ayuda del Sistema*\n\n"
+            "*Cómo funciona:*\n"
+            "1. Los usuarios agregan ubicaciones desde la web\n"
+            "2. Llegan aquí como solicitudes pendientes\n"
+            "3. Usa los botones para aprobar/rechazar\n\n"
+            "*Comandos:*\n"
+            "/lista - Ver solicitudes\n"
+            "/aprobar id1 id2 ... - Aprobar en lote\n"
+            "/aprobar_todo HN - Aprobar todas las de un país\n"
+            "/rechazar id1 id2 ... - Rechazar en lote\n"
+            "/rechazar_todo - Rechazar todas\n"
+            "/paises - Países disponibles"
+        ),
+        'countries': "*🌎 Países soportados:*\n\n{countries!r}",
+        'unsupported_country': "❌ País no soportado: {pais}",
+        'not_found': "❌ Solicitud no encontrada",
+        'text_not_found': "📭 No se encontró la solicitud",
+        'save_error': "❌ Error al guardar la ubicación",
+        'command_error': "❌ Error procesando el comando",
+        'no_pending': "📭 No hay solicitudes pendientes.",
+        'pending_header': "📋 *Solicitudes Pendientes:*\n",
+        'pending_error': "❌ Error mostrando solicitudes",
+        'batch_empty': "📭 No hay solicitudes pendientes para procesar.",
+        'batch_save_error': "❌ Error al guardar el lote ({count} solicitudes siguen pendientes)",
+        'batch_approved': "✅ *{count} solicitudes aprobadas*\n",
+        'batch_rejected': "❌ *{count} solicitudes rechazadas*\n",
+        'batch_more': "... y {count} más",
+        'batch_missing': "\n⚠️ {count} no encontradas o ya procesadas",
+        'batch_error': "❌ Error procesando el lote",
+        'text_approved': "✅ *{name}* aprobada exitosamente.",
+        'text_rejected': "❌ *{name}* rechazada.",
+        'reminder_header': "⏰ *{count} solicitudes expiran pronto*\n",
+        'reminder_footer': "\nUsa /lista para revisarlas o /aprobar_todo para aprobarlas.",
+    },
+}
+
+COUNTRY_TEMPLATES = {
+    'es': {
+        'new_request': (
+            "{emoji} *NUEVA SOLICITUD - {COUNTRY}*\n\n"
+            "*📌 Nombre:* {name}\n"
+            "*📍 Coordenadas:* `{coords}`\n"
+            "*📋 Tipo:* {type}\n\n"
+            "*🔍 Detectado:* {detected}\n\n"
+            "*🆔 ID:* `{request_id}`"
+        ),
+        'approved': "✅ *APROBADO - {emoji} {country}*\n\n*{name}* ha sido agregada exitosamente.",
+        'rejected': "❌ *RECHAZADO - {emoji} {country}*\n\n*{name}* ha sido rechazada.",
+        'approved_web': "✅ *{name}* aprobada en {country}!",
+        'country_line': "{emoji} *{country}*",
+        'pending_line': (
+            "{emoji} *{name}*\n"
+            "   🆔: `{request_id}`\n"
+            "   📍: `{coords}`\n"
+            "   🕒: {time}\n"
+        ),
+        'batch_line': "{emoji} {name}",
+        'reminder_line': "{emoji} `{request_id}` {name} ({hours:.0f} h)",
+    },
+}
+
+
+class MessageCatalog:
+    """Plantillas compiladas para un idioma y un conjunto de países"""
+
+    def __init__(self, countries, lang='es'):
+        self.by_country = {
+            pais: {
+                key: Template(
+                    source, emoji=country['emoji'], country=country['name'],
+                    COUNTRY=country['name'].upper()
+                )
+                for key, source in COUNTRY_TEMPLATES[lang].items()
+            }
+            for pais, country in countries.items()
+        }
+        # Países desconocidos: sin emoji de bandera
+        self.fallback = {
+            key: Template(source, emoji='📍', country='el país', COUNTRY='')
+            for key, source in COUNTRY_TEMPLATES[lang].items()
+        }
+
+        # Listas de países fijas en /start y /paises (se resuelven al compilar)
+        constants = {
+            'start': {'countries': '\n'.join(
+                escape(f"{country['emoji']} {country['name']}") for country in countries.values()
+            )},
+            'countries': {'countries': '\n'.join(
+                self.by_country[pais]['country_line'].render() for pais in countries
+            )},
+        }
+        self.texts = {
+            key: Template(source, **constants.get(key, {}))
+            for key, source in TEMPLATES[lang].items()
+        }
+
+    def text(self, key, **values):
+        return self.texts[key].render(**values)
+
+    def country(self, pais, key, **values):
+        return self.by_country.get(pais, self.fallback)[key].render(**values)
+
+
+def chunk_lines(lines, header='', footer='', separator='\n', limit=MAX_MESSAGE_LENGTH):
+    """Repartir líneas ya renderizadas en mensajes que no superen `limit`.
+
+    El encabezado va en el primer mensaje y el pie en el último; una línea
+    nunca se corta entre dos mensajes.
+    """
+    chunks = []
+    current = [header] if header else []
+    size = message_length(header)
+    sep_size = message_length(separator)
+    footer_size = message_length(footer) + sep_size if footer else 0
+
+    for line in lines:
+        line_size = message_length(line)
+        extra = line_size + (sep_size if current else 0)
+        if current and size + extra > limit:
+            chunks.append(separator.join(current))
+            current, size, extra = [], 0, line_size
+        current.append(line)
+        size += extra
+
+    if footer:
+        if current and size + footer_size > limit:
+            chunks.append(separator.join(current))
+            current = []
+        current.append(footer)
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+# ========== TECLADOS ==========
+def request_keyboard(request_id, maps_url):
+    """Botones de una solicitud nueva"""
+    return {
+        "inline_keyboard": [
+            [
+                {"text": "✅ Aprobar", "callback_data": f"approve_{request_id}"},
+                {"text": "❌ Rechazar", "callback_data": f"reject_{request_id}"}
+            ],
+            [
+                {"text": "🗺️ Ver en Maps", "url": maps_url},
+                {"text": "📋 Copiar coords", "callback_data": f"copy_{request_id}"}
+            ]
+        ]
+    }
+
+
+def pending_keyboard(total, until_ms, by_country, countries):
+    """Aprobar todo lo listado, y por país si hay más de uno"""
+    buttons = [[{
+        "text": f"✅ Aprobar todas ({total})",
+        "callback_data": f"approvevisible_{until_ms}"
+    }]]
+    if len(by_country) > 1:
+        buttons.append([
+            {
+                "text": f"{countries.get(pais, {}).get('emoji', '📍')} {pais} ({count})",
+                "callback_data": f"approvevisible_{until_ms}_{pais}"
+            }
+            for pais, count in by_country.items()
+        ])
+    return {"inline_keyboard": buttons}
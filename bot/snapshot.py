@@ -0,0 +1,253 @@
+"""Snapshot de ubicaciones con recarga en segundo plano (sin reiniciar workers)
+
+Cada worker tiene su propio hilo de recarga. Con LocalStorage los cambios
+se aplican como delta sobre el snapshot precargado en el master, que sigue
+compartido. Con GitHub cada cambio del archivo hace que cada worker lo
+descargue, parsee e indexe completo en memoria propia (memoria y CPU
+proporcionales al número de workers) hasta el próximo SIGHUP, que vuelve
+a cargar en el master y recrea los workers.
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+import traceback
+
+import requests
+
+# Índices derivados que se construyen junto con cada snapshot: nombre -> builder(data)
+_index_builders = {}
+
+
+def register_index(name, builder):
+    """Registrar un índice derivado que se reconstruye en cada recarga"""
+    _index_builders[name] = builder
+
+
+def git_blob_sha(content):
+    """SHA de blob de git (el mismo que devuelve la API de contenidos de GitHub)"""
+    header = f"blob {len(content)}\0".encode('utf-8')
+    return hashlib.sha1(header + content).hexdigest()
+
+
+def parse_locations(content):
+    """Decodificar el archivo de ubicaciones (vacío -> diccionario vacío)"""
+    text = content.decode('utf-8') if isinstance(content, bytes) else content
+    return json.loads(text) if text.strip() else {}
+
+
+class Snapshot:
+    """Vista inmutable del archivo de ubicaciones y sus índices.
+
+    `data` es el resultado de la última carga completa (en los workers, la
+    del master: compartida copy-on-write); `added` son las entradas que
+    llegaron después como cambios incrementales (ver extend).
+    """
+    __slots__ = ('data', 'added', 'sha', 'loaded_at', 'indexes')
+
+    def __init__(self, data, sha=None, added=None, indexes=None):
+        self.data = data
+        self.added = added or {}
+        self.sha = sha
+        self.loaded_at = time.time()
+        if indexes is not None:
+            self.indexes = indexes
+            return
+        self.indexes = {}
+        for name, builder in _index_builders.items():
+            try:
+                self.indexes[name] = builder(data)
+            except Exception as e:
+                print(f"❌ Error construyendo índice {name}: {e}")
+                traceback.print_exc()
+
+    def count(self, countries):
+        return sum(len(self.data.get(country, {})) + len(self.added.get(country, ()))
+                   for country in countries)
+
+    def extend(self, changes, sha):
+        """Snapshot nuevo con `changes` (pais, clave, registro) agregadas.
+
+        Comparte `data` y los índices base sin tocarlos; solo se copian las
+        entradas agregadas desde la última carga completa. Si algún índice
+        no sabe extenderse se reconstruye todo.
+        """
+        added = {pais: dict(entries) for pais, entries in self.added.items()}
+        for pais, key, entry in changes:
+            added.setdefault(pais, {})[key] = entry
+
+        indexes = {}
+        for name, index in self.indexes.items():
+            extend = getattr(index, 'extend', None)
+            if extend is None:
+                data = {pais: dict(entries) for pais, entries in self.data.items()}
+                for pais, entries in added.items():
+                    data.setdefault(pais, {}).update(entries)
+                return Snapshot(data, sha=sha)
+            indexes[name] = extend(changes)
+        return Snapshot(self.data, sha=sha, added=added, indexes=indexes)
+
+
+class GithubSource:
+    """Archivo en GitHub consultado con peticiones condicionales (ETag)"""
+
+    def __init__(self, repo, path, token='', branch='main'):
+        self.url = f"https://api.github.com/repos/{repo}/contents/{path}"
+        self.branch = branch
+        self.token = token
+        self._etag = None
+
+    def fetch(self, known_sha=None):
+        """Devolver (sha, data) si el archivo cambió, None si no"""
+        headers = {"Accept": "application/vnd.github.v3+json"}
+        if self.token:
+            headers["Authorization"] = f"token {self.token}"
+        if self._etag and known_sha:
+            headers["If-None-Match"] = self._etag
+
+        response = requests.get(self.url, headers=headers, params={"ref": self.branch}, timeout=15)
+        if response.status_code == 304:
+            return None
+        if response.status_code != 200:
+            raise RuntimeError(f"GitHub respondió {response.status_code}")
+
+        self._etag = response.headers.get('ETag')
+        file_data = response.json()
+        if file_data['sha'] == known_sha:
+            return None
+
+        if file_data.get('content'):
+            content = base64.b64decode(file_data['content'])
+        else:
+            # Archivos > 1 MB: la API no incluye el contenido
+            raw = requests.get(file_data['download_url'], headers=headers, timeout=60)
+            raw.raise_for_status()
+            content = raw.content
+        return file_data['sha'], parse_locations(content)
+
+
+class LocalFileSource:
+    """Archivo local; solo se relee si cambian mtime o tamaño"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stat = None
+
+    def fetch(self, known_sha=None):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if known_sha and signature == self._stat:
+            return None
+
+        with open(self.path, 'rb') as fh:
+            content = fh.read()
+        self._stat = signature
+        sha = git_blob_sha(content)
+        if sha == known_sha:
+            return None
+        return sha, parse_locations(content)
+
+
+class SnapshotManager:
+    """Mantiene el snapshot actual y lo reemplaza atómicamente (estilo RCU).
+
+    Las lecturas toman `manager.current` una vez y trabajan sobre ese objeto,
+    así una recarga en paralelo nunca les cambia los datos a mitad de camino.
+    """
+
+    def __init__(self, source, fallback=None, interval=60):
+        self.source = source
+        self.fallback = fallback
+        self.interval = interval
+        self.current = Snapshot({})
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """Carga inicial: fuente principal, o respaldo si no está disponible.
+
+        "Sin cambios" no es un fallo: en una recarga (SIGHUP) el snapshot
+        vigente se conserva y el respaldo solo se usa si aún no hay ninguno.
+        """
+        try:
+            self.refresh()
+            if self.current.sha is not None:
+                return self.current
+        except Exception as e:
+            print(f"⚠️ No se pudo cargar el snapshot de la fuente principal: {e}")
+            if self.current.sha is not None:
+                return self.current
+        if self.fallback is not None:
+            try:
+                result = self.fallback.fetch()
+                if result:
+                    self.current = Snapshot(result[1], sha=result[0])
+            except Exception as e:
+                print(f"⚠️ No se pudo cargar el snapshot de respaldo: {e}")
+        return self.current
+
+    def refresh(self):
+        """Consultar la fuente y publicar un snapshot nuevo si cambió.
+
+        Si la fuente tiene fetch_changes (LocalStorage) se extiende el
+        snapshot actual con lo nuevo; si no, se descarga y reindexa todo.
+        """
+        with self._refresh_lock:
+            fetch_changes = getattr(self.source, 'fetch_changes', None)
+            if fetch_changes is not None:
+                result = fetch_changes(self.current.sha)
+                if result is None:
+                    return False
+                sha, data, changes = result
+                if changes is not None:
+                    self.current = self.current.extend(changes, sha=sha)
+                    if changes:
+                        print(f"🔄 Snapshot extendido: {str(sha)[:8]} (+{len(changes)})")
+                    return True
+            else:
+                result = self.source.fetch(self.current.sha)
+                if result is None:
+                    return False
+                sha, data = result
+            # Construir índices fuera del camino de las peticiones y luego
+            # publicar con una sola asignación
+            self.current = Snapshot(data, sha=sha)
+            print(f"🔄 Snapshot actualizado: {str(sha)[:8]}")
+            return True
+
+    def request_refresh(self):
+        """Pedir al hilo de recarga que consulte la fuente cuanto antes.
+
+        Solo con fuentes incrementales: con GitHub cada recarga descarga y
+        reindexa el archivo completo en cada worker, así que las aprobaciones
+        se recogen en la siguiente consulta periódica.
+        """
+        if hasattr(self.source, 'fetch_changes'):
+            self._wake.set()
+
+    def start(self):
+        """Iniciar el hilo de recarga (una vez por proceso, después del fork)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='snapshot-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ Error recargando snapshot: {e}")
@@ -1,2 +1,2 @@
 #!/bin/bash
-gunicorn app:app --bind 0.0.0.0:$PORT --workers=2 --threads=4 --worker-class=gthread
\ No newline at end of file
+gunicorn app:app --config gunicorn.conf.py
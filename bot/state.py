@@ -0,0 +1,356 @@
+"""Estado mutable compartido entre workers (solicitudes pendientes)"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from geo import format_coords
+
+PENDING_DB = os.getenv('PENDING_DB', '')
+PENDING_TTL = 72 * 3600
+PENDING_MAX = 5000
+PENDING_REMIND_BEFORE = 12 * 3600
+
+
+class PendingRequest:
+    """Solicitud pendiente compacta: campos planos y hora de creación en epoch"""
+    __slots__ = ('name', 'lat', 'lon', 'pais', 'type', 'detected', 'chat_id', 'created', 'reminded')
+
+    def __init__(self, name, lat, lon, pais, type, detected, chat_id, created=None, reminded=False):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.pais = pais
+        self.type = type
+        self.detected = detected
+        self.chat_id = chat_id
+        self.created = time.time() if created is None else created
+        self.reminded = reminded
+
+    @classmethod
+    def from_location(cls, location, chat_id):
+        """Crear desde el diccionario devuelto por validate_location"""
+        return cls(
+            location['name'], location['lat'], location['lon'], location['pais'],
+            location['type'], location['detected'], chat_id
+        )
+
+    @property
+    def coords(self):
+        return format_coords(self.lat, self.lon)
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.created).isoformat()
+
+    @property
+    def location(self):
+        """Diccionario de ubicación para el backend de almacenamiento"""
+        return {
+            'name': self.name,
+            'coords': self.coords,
+            'lat': self.lat,
+            'lon': self.lon,
+            'pais': self.pais,
+            'type': self.type,
+            'detected': self.detected
+        }
+
+    def to_row(self):
+        return [self.name, self.lat, self.lon, self.pais, self.type, self.detected, self.chat_id]
+
+    @classmethod
+    def from_row(cls, row, created, reminded=False):
+        return cls(*row, created=created, reminded=bool(reminded))
+
+
+class MemoryPendingStore:
+    """Solicitudes pendientes en memoria (un solo proceso).
+
+    En orden de llegada: expirar o desalojar la más antigua es sacar del frente.
+    """
+
+    def __init__(self, ttl=PENDING_TTL, max_size=PENDING_MAX, remind_before=PENDING_REMIND_BEFORE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.remind_before = remind_before
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _alive(self, record, now=None):
+        return record.created >= (now or time.time()) - self.ttl
+
+    def __contains__(self, request_id):
+        return self.get(request_id) is not None
+
+    def __getitem__(self, request_id):
+        record = self.get(request_id)
+        if record is None:
+            raise KeyError(request_id)
+        return record
+
+    def __setitem__(self, request_id, record):
+        cutoff = time.time() - self.ttl
+        evicted = 0
+        with self._lock:
+            self._data[request_id] = record
+            while self._data:
+                oldest = next(iter(self._data.values()))
+                if oldest.created >= cutoff and len(self._data) <= self.max_size:
+                    break
+                self._data.popitem(last=False)
+                if oldest.created >= cutoff:
+                    evicted += 1
+        if evicted:
+            print(f"🗑️ {evicted} solicitudes desalojadas (límite de {self.max_size})")
+
+    def __delitem__(self, request_id):
+        with self._lock:
+            del self._data[request_id]
+
+    def __len__(self):
+        # Solo las vigentes, igual que SqlitePendingStore
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            return sum(1 for record in self._data.values() if record.created >= cutoff)
+
+    def get(self, request_id, default=None):
+        record = self._data.get(request_id)
+        if record is None or not self._alive(record):
+            return default
+        return record
+
+    def keys(self):
+        return [request_id for request_id, _ in self.items()]
+
+    def items(self):
+        now = time.time()
+        with self._lock:
+            return [(request_id, record) for request_id, record in self._data.items()
+                    if self._alive(record, now)]
+
+    def pop(self, request_id, default=None):
+        """Reclamar una solicitud de forma atómica"""
+        with self._lock:
+            record = self._data.pop(request_id, None)
+        if record is None or not self._alive(record):
+            return default
+        return record
+
+    def pop_many(self, request_ids):
+        """Reclamar varias solicitudes de una vez; devuelve las que existían"""
+        now = time.time()
+        with self._lock:
+            claimed = {
+                request_id: self._data.pop(request_id)
+                for request_id in dict.fromkeys(request_ids) if request_id in self._data
+            }
+        return {request_id: record for request_id, record in claimed.items()
+                if self._alive(record, now)}
+
+    def expire(self):
+        """Eliminar las solicitudes vencidas; devuelve cuántas"""
+        now = time.time()
+        with self._lock:
+            # Una solicitud restaurada tras un fallo puede quedar fuera de orden
+            expired = [request_id for request_id, record in self._data.items()
+                       if not self._alive(record, now)]
+            for request_id in expired:
+                del self._data[request_id]
+        return len(expired)
+
+    def claim_reminders(self):
+        """Marcar y devolver las solicitudes próximas a expirar sin recordatorio"""
+        now = time.time()
+        due_before = now - self.ttl + self.remind_before
+        due = []
+        with self._lock:
+            for request_id, record in self._data.items():
+                if not record.reminded and record.created <= due_before and self._alive(record, now):
+                    record.reminded = True
+                    due.append((request_id, record))
+        return due
+
+
+class SqlitePendingStore:
+    """Solicitudes pendientes en SQLite, compartidas por todos los workers.
+
+    Cada hilo/proceso abre su propia conexión (nunca se heredan tras fork).
+    Los campos se guardan como un arreglo JSON compacto; la hora de creación
+    va en una columna indexada para expirar y desalojar sin recorrer la tabla.
+    """
+
+    def __init__(self, path, ttl=PENDING_TTL, max_size=PENDING_MAX,
+                 remind_before=PENDING_REMIND_BEFORE):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.remind_before = remind_before
+        self._local = threading.local()
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS pending_requests ("
+            "request_id TEXT PRIMARY KEY, created REAL NOT NULL, "
+            "reminded INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL)"
+        )
+        self._execute(
+            "CREATE INDEX IF NOT EXISTS pending_requests_created ON pending_requests (created)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, sql, params=()):
+        return self._connection().execute(sql, params)
+
+    def _cutoff(self):
+        return time.time() - self.ttl
+
+    @staticmethod
+    def _record(data, created, reminded):
+        return PendingRequest.from_row(json.loads(data), created, reminded)
+
+    def __contains__(self, request_id):
+        row = self._execute(
+            "SELECT 1 FROM pending_requests WHERE request_id = ? AND created >= ?",
+            (request_id, self._cutoff())
+        ).fetchone()
+        return row is not None
+
+    def __getitem__(self, request_id):
+        record = self.get(request_id)
+        if record is None:
+            raise KeyError(request_id)
+        return record
+
+    def __setitem__(self, request_id, record):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO pending_requests (request_id, created, reminded, data) "
+                "VALUES (?, ?, ?, ?)",
+                (request_id, record.created, int(record.reminded),
+                 json.dumps(record.to_row(), ensure_ascii=False, separators=(',', ':')))
+            )
+            conn.execute("DELETE FROM pending_requests WHERE created < ?", (self._cutoff(),))
+            # Desalojar las más antiguas por encima del límite
+            evicted = conn.execute(
+                "DELETE FROM pending_requests WHERE request_id IN ("
+                "SELECT request_id FROM pending_requests ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,)
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if evicted:
+            print(f"🗑️ {evicted} solicitudes desalojadas (límite de {self.max_size})")
+
+    def __delitem__(self, request_id):
+        cursor = self._execute("DELETE FROM pending_requests WHERE request_id = ?", (request_id,))
+        if cursor.rowcount == 0:
+            raise KeyError(request_id)
+
+    def __len__(self):
+        return self._execute(
+            "SELECT COUNT(*) FROM pending_requests WHERE created >= ?", (self._cutoff(),)
+        ).fetchone()[0]
+
+    def get(self, request_id, default=None):
+        row = self._execute(
+            "SELECT data, created, reminded FROM pending_requests "
+            "WHERE request_id = ? AND created >= ?",
+            (request_id, self._cutoff())
+        ).fetchone()
+        return self._record(*row) if row else default
+
+    def keys(self):
+        return [row[0] for row in self._execute(
+            "SELECT request_id FROM pending_requests WHERE created >= ? ORDER BY created",
+            (self._cutoff(),)
+        )]
+
+    def items(self):
+        return [
+            (row[0], self._record(row[1], row[2], row[3]))
+            for row in self._execute(
+                "SELECT request_id, data, created, reminded FROM pending_requests "
+                "WHERE created >= ? ORDER BY created",
+                (self._cutoff(),)
+            )
+        ]
+
+    def pop(self, request_id, default=None):
+        """Reclamar una solicitud de forma atómica (solo un worker la obtiene)"""
+        return self.pop_many([request_id]).get(request_id, default)
+
+    def pop_many(self, request_ids):
+        """Reclamar varias solicitudes en una sola transacción"""
+        request_ids = list(dict.fromkeys(request_ids))
+        if not request_ids:
+            return {}
+        placeholders = ','.join('?' * len(request_ids))
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT request_id, data, created, reminded FROM pending_requests "
+                f"WHERE request_id IN ({placeholders}) AND created >= ?",
+                request_ids + [self._cutoff()]
+            ).fetchall()
+            conn.execute(
+                f"DELETE FROM pending_requests WHERE request_id IN ({placeholders})", request_ids
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {row[0]: self._record(row[1], row[2], row[3]) for row in rows}
+
+    def expire(self):
+        """Eliminar las solicitudes vencidas; devuelve cuántas"""
+        return self._execute(
+            "DELETE FROM pending_requests WHERE created < ?", (self._cutoff(),)
+        ).rowcount
+
+    def claim_reminders(self):
+        """Marcar y devolver las solicitudes próximas a expirar (solo un worker las obtiene)"""
+        now = time.time()
+        params = (now - self.ttl + self.remind_before, now - self.ttl)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT request_id, data, created FROM pending_requests "
+                "WHERE reminded = 0 AND created <= ? AND created >= ? ORDER BY created",
+                params
+            ).fetchall()
+            conn.execute(
+                "UPDATE pending_requests SET reminded = 1 "
+                "WHERE reminded = 0 AND created <= ? AND created >= ?",
+                params
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(row[0], self._record(row[1], row[2], True)) for row in rows]
+
+
+def create_pending_store(path=PENDING_DB, ttl=PENDING_TTL, max_size=PENDING_MAX,
+                         remind_before=PENDING_REMIND_BEFORE):
+    """Backend compartido si PENDING_DB está configurado, memoria si no"""
+    if path:
+        print(f"🗄️ Pendientes compartidos en SQLite: {path}")
+        return SqlitePendingStore(path, ttl, max_size, remind_before)
+    return MemoryPendingStore(ttl, max_size, remind_before)
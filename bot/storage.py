@@ -0,0 +1,561 @@
+"""Backends de almacenamiento para las ubicaciones aprobadas"""
+import io
+import os
+import json
+import base64
+import fcntl
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+
+from geo import LocationError, parse_coords
+from jsonstream import SpliceError, splice_entries, write_locations
+from keys import KeyIndex
+from tracing import span
+
+# Bloques de descarga y de codificación base64 (múltiplo de 3: sin relleno intermedio)
+DOWNLOAD_CHUNK = 1 << 20
+ENCODE_CHUNK = 3 << 18
+
+
+class StorageError(Exception):
+    """Error al leer o escribir en el backend de almacenamiento"""
+
+
+def build_entry(location):
+    """Convertir una ubicación validada en (pais, nombre, registro)"""
+    pais = location.get('pais', 'HN')
+    name = location.get('name', 'Ubicación sin nombre')
+
+    if 'lat' in location and 'lon' in location:
+        lat, lon = location['lat'], location['lon']
+    else:
+        try:
+            lat, lon = parse_coords(location.get('coords'))
+        except LocationError as e:
+            raise StorageError(f"Coordenadas inválidas para {name}: {e}")
+
+    # **ESTRUCTURA SIMPLIFICADA - SOLO DATOS BÁSICOS**
+    entry = {
+        "name": name,
+        "lat": lat,
+        "lon": lon,
+        "pais": pais,
+        "type": location.get('type', 'colonia'),
+        "added": datetime.now().isoformat(),
+        "approved": True,
+        "source": "user_submission",
+        "detected_automatically": True,
+        "full_address": location.get('detected', 'No detectado automáticamente')
+    }
+    return pais, name, entry
+
+
+def ensure_countries(data, countries):
+    """Inicializar estructura por países si no existe"""
+    for country_code in countries:
+        if country_code not in data:
+            data[country_code] = {}
+    return data
+
+
+class StorageBackend:
+    """Interfaz común: leer snapshot, aplicar lote, obtener versión.
+
+    También implementa fetch(), así cualquier backend sirve como fuente
+    para SnapshotManager.
+    """
+    name = 'base'
+
+    def read_snapshot(self):
+        """Devolver (versión, datos)"""
+        raise NotImplementedError
+
+    def get_version(self):
+        raise NotImplementedError
+
+    def apply_batch(self, locations, message=None):
+        """Guardar varias ubicaciones en una sola escritura; devuelve las claves"""
+        raise NotImplementedError
+
+    def fetch(self, known_sha=None):
+        if known_sha is not None and self.get_version() == known_sha:
+            return None
+        return self.read_snapshot()
+
+
+class GithubStorage(StorageBackend):
+    """Archivo JSON en un repositorio de GitHub (API de contenidos).
+
+    El archivo nunca se tiene completo en memoria al escribir: se descarga a
+    un temporal, se le insertan los registros en streaming (jsonstream) y el
+    cuerpo del PUT se codifica en base64 por bloques a otro temporal.
+    """
+    name = 'github'
+
+    def __init__(self, repo, path, token, countries):
+        self.api = f"https://api.github.com/repos/{repo}"
+        self.url = f"{self.api}/contents/{path}"
+        self.token = token
+        self.countries = countries
+
+    def _headers(self, accept="application/vnd.github.v3+json"):
+        if not self.token:
+            raise StorageError("GitHub Token no configurado")
+        return {
+            "Authorization": f"token {self.token}",
+            "Accept": accept
+        }
+
+    def _get_file(self):
+        print(f"📥 Obteniendo archivo: {self.url}")
+        with span('github.get'):
+            response = requests.get(self.url, headers=self._headers(), timeout=30)
+        if response.status_code != 200:
+            raise StorageError(f"Error obteniendo archivo: {response.status_code}")
+        return response.json()
+
+    def _download(self, fh):
+        """Escribir el contenido actual en `fh` (binario); devuelve su SHA"""
+        file_data = self._get_file()
+        with span('github.download'):
+            if file_data.get('encoding') == 'base64' and file_data.get('content'):
+                # Hasta 1 MB la API lo incluye en la respuesta
+                fh.write(base64.b64decode(file_data['content']))
+            else:
+                # Archivos grandes: el blob crudo por su SHA, en bloques
+                response = requests.get(
+                    f"{self.api}/git/blobs/{file_data['sha']}",
+                    headers=self._headers("application/vnd.github.raw"),
+                    stream=True, timeout=60
+                )
+                if response.status_code != 200:
+                    raise StorageError(f"Error descargando archivo: {response.status_code}")
+                for block in response.iter_content(DOWNLOAD_CHUNK):
+                    fh.write(block)
+        fh.flush()
+        fh.seek(0)
+        return file_data['sha']
+
+    def get_version(self):
+        return self._get_file()['sha']
+
+    def read_snapshot(self):
+        with tempfile.TemporaryFile() as fh:
+            sha = self._download(fh)
+            content = fh.read()
+        with span('github.parse'):
+            data = json.loads(content) if content.strip() else {}
+        return sha, ensure_countries(data, self.countries)
+
+    def _rewrite(self, current, updated, entries):
+        """Camino lento: parsear todo y volver a escribir con indent=2"""
+        with span('github.parse'):
+            content = current.read()
+            data = ensure_countries(json.loads(content) if content.strip() else {}, self.countries)
+            del content
+        key_index = KeyIndex(data)
+        keys = []
+        for pais, name, entry in entries:
+            key = key_index.allocate(pais, name)
+            data.setdefault(pais, {})[key] = entry
+            keys.append(key)
+        with span('github.serialize'):
+            out = io.TextIOWrapper(updated, encoding='utf-8')
+            json.dump(data, out, indent=2, ensure_ascii=False)
+            out.flush()
+            out.detach()
+        return keys
+
+    def apply_batch(self, locations, message=None):
+        entries = [build_entry(location) for location in locations]
+        if not entries:
+            return []
+
+        with tempfile.TemporaryFile() as current, tempfile.TemporaryFile() as updated, \
+                tempfile.TemporaryFile() as body:
+            sha = self._download(current)
+
+            # Insertar las entradas sin parsear el archivo completo
+            try:
+                with span('github.splice'):
+                    keys = splice_entries(current, updated, entries)
+            except SpliceError as e:
+                print(f"⚠️ {e}; se reescribe el archivo completo")
+                current.seek(0)
+                updated.seek(0)
+                updated.truncate()
+                keys = self._rewrite(current, updated, entries)
+
+            if message is None:
+                if len(entries) == 1:
+                    pais, name, _ = entries[0]
+                    message = f"📍 Agregar en {self.countries.get(pais, {}).get('name', pais)}: {name}"
+                else:
+                    message = f"📍 Agregar {len(entries)} ubicaciones"
+
+            # Cuerpo del PUT con el contenido en base64, codificado por bloques
+            with span('github.encode'):
+                updated.seek(0)
+                body.write(b'{"message": ' + json.dumps(message).encode('ascii') +
+                           b', "sha": ' + json.dumps(sha).encode('ascii') + b', "content": "')
+                while True:
+                    block = updated.read(ENCODE_CHUNK)
+                    if not block:
+                        break
+                    body.write(base64.b64encode(block))
+                body.write(b'"}')
+                body.flush()
+                body.seek(0)
+
+            print(f"📤 Subiendo cambios a GitHub...")
+            headers = self._headers()
+            headers["Content-Type"] = "application/json"
+            with span('github.put'):
+                update_response = requests.put(self.url, headers=headers, data=body, timeout=120)
+
+        print(f"📨 Respuesta GitHub: {update_response.status_code}")
+        if update_response.status_code != 200:
+            raise StorageError(f"Error GitHub: {update_response.text[:200]}")
+        return keys
+
+
+class LocalStorage(StorageBackend):
+    """Archivo JSON local con journal de solo-anexar.
+
+    Cada lote se agrega como líneas NDJSON al journal (una escritura). Cuando
+    el journal llega a `checkpoint_ratio` del tamaño del archivo se escribe
+    un checkpoint en un hilo aparte, sobre una copia de los datos; el flock
+    solo se toma para el os.replace y para rotar el journal. El journal
+    nuevo empieza con una línea que describe el checkpoint y el anterior
+    queda como `.prev`, así los demás workers se ponen al día sin volver a
+    leer el archivo completo.
+    Un flock sobre `<archivo>.lock` serializa a los workers de gunicorn.
+    """
+    name = 'local'
+
+    def __init__(self, path, countries, fsync=False, checkpoint_ratio=0.25,
+                 checkpoint_min_bytes=1 << 20):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.prev_journal_path = path + '.journal.prev'
+        self.lock_path = path + '.lock'
+        self.checkpoint_lock_path = path + '.checkpoint.lock'
+        self.countries = countries
+        self.fsync = fsync
+        self.checkpoint_ratio = checkpoint_ratio
+        self.checkpoint_min_bytes = checkpoint_min_bytes
+        self._thread_lock = threading.Lock()
+        self._lock_fd = None
+        self._lock_pid = None
+        self._data = None
+        self._file_id = None
+        self._journal_offset = 0
+        self._key_index = None
+        self._checkpoint_thread = None
+        # Entradas aplicadas desde la versión `_changes_since` (para fetch_changes)
+        self._changes = None
+        self._changes_since = None
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            # El descriptor del lock no puede heredarse del master tras el fork
+            if self._lock_pid != os.getpid():
+                self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._lock_pid = os.getpid()
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _stat_file(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_header(self):
+        """Línea de checkpoint al inicio del journal: (registro, largo) o (None, 0)"""
+        try:
+            with open(self.journal_path, 'rb') as fh:
+                line = fh.readline()
+        except FileNotFoundError:
+            return None, 0
+        if not line.endswith(b'\n') or not line.startswith(b'{"checkpoint"'):
+            return None, 0
+        return json.loads(line)['checkpoint'], len(line)
+
+    def _adopt_checkpoint(self, file_id):
+        """¿El archivo nuevo es un checkpoint de lo que ya tenemos en memoria?
+
+        Si el journal empieza con la línea del checkpoint que pasó de nuestro
+        archivo a `file_id`, basta con leer lo que nos faltaba del journal
+        anterior (`<journal>.prev`) y mover el offset.
+        """
+        if self._data is None or self._file_id is None or file_id is None:
+            return False
+        header, header_length = self._read_header()
+        if (header is None or tuple(header['file']) != file_id
+                or tuple(header['base'] or ()) != self._file_id):
+            return False
+        if self._journal_offset < header['offset']:
+            try:
+                with open(self.prev_journal_path, 'rb') as fh:
+                    if os.fstat(fh.fileno()).st_ino != header['journal']:
+                        return False
+                    fh.seek(self._journal_offset)
+                    missing = fh.read(header['offset'] - self._journal_offset)
+            except FileNotFoundError:
+                return False
+            self._apply_lines(missing)
+            self._journal_offset = header['offset']
+        self._journal_offset = header_length + self._journal_offset - header['offset']
+        self._file_id = file_id
+        return True
+
+    def _sync(self):
+        """Ponerse al día con el archivo y el journal (requiere el lock)"""
+        file_id = self._stat_file()
+        if self._data is None or (file_id != self._file_id and not self._adopt_checkpoint(file_id)):
+            data = {}
+            if file_id is not None:
+                with open(self.path, encoding='utf-8') as fh:
+                    content = fh.read()
+                data = json.loads(content) if content.strip() else {}
+            self._data = ensure_countries(data, self.countries)
+            self._file_id = file_id
+            self._journal_offset = 0
+            self._key_index = KeyIndex(self._data)
+            self._changes = None
+
+        try:
+            with open(self.journal_path, 'rb') as fh:
+                fh.seek(self._journal_offset)
+                tail = fh.read()
+        except FileNotFoundError:
+            return
+
+        # Una última línea sin '\n' es una escritura interrumpida: se ignora
+        end = tail.rfind(b'\n') + 1
+        self._apply_lines(tail[:end])
+        self._journal_offset += end
+
+    def _apply_lines(self, lines):
+        for line in lines.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                if 'checkpoint' not in record:
+                    self._apply(record['pais'], record['key'], record['entry'])
+
+    def _apply(self, pais, key, entry):
+        self._data.setdefault(pais, {})[key] = entry
+        self._key_index.load(pais, (key,))
+        if self._changes is not None:
+            self._changes.append((pais, key, entry))
+
+    def _version(self):
+        if self._file_id is None:
+            return f"0:{self._journal_offset}"
+        return f"{self._file_id[0]}-{self._file_id[1]}:{self._journal_offset}"
+
+    def get_version(self):
+        with self._locked():
+            self._sync()
+            return self._version()
+
+    def _copy(self):
+        # Copia superficial por país: los registros nunca se modifican
+        return {pais: dict(entries) for pais, entries in self._data.items()}
+
+    def read_snapshot(self):
+        with self._locked():
+            self._sync()
+            return self._version(), self._copy()
+
+    def fetch_changes(self, known_sha=None):
+        """Lo nuevo desde `known_sha`, para extender un snapshot sin releer todo.
+
+        Devuelve None si no hubo cambios, o (versión, datos, cambios): los
+        cambios son una lista de (pais, clave, registro) desde `known_sha`;
+        si no se pueden expresar así (primera carga, el archivo se releyó
+        completo) van los datos completos y cambios es None.
+        """
+        with self._locked():
+            self._sync()
+            version = self._version()
+            if version == known_sha:
+                return None
+            if self._changes is not None and known_sha == self._changes_since:
+                result = (version, None, self._changes)
+            else:
+                result = (version, self._copy(), None)
+            self._changes = []
+            self._changes_since = version
+            return result
+
+    def apply_batch(self, locations, message=None):
+        entries = [build_entry(location) for location in locations]
+        if not entries:
+            return []
+
+        with self._locked(), span('local.apply_batch'):
+            self._sync()
+
+            keys = []
+            lines = []
+            for pais, name, entry in entries:
+                key = self._key_index.allocate(pais, name)
+                keys.append(key)
+                lines.append(json.dumps(
+                    {"pais": pais, "key": key, "entry": entry}, ensure_ascii=False
+                ))
+            payload = ('\n'.join(lines) + '\n').encode('utf-8')
+
+            with open(self.journal_path, 'ab') as fh:
+                # Descartar una línea incompleta de una escritura interrumpida
+                if fh.tell() > self._journal_offset:
+                    fh.truncate(self._journal_offset)
+                fh.write(payload)
+                fh.flush()
+                if self.fsync:
+                    os.fsync(fh.fileno())
+            self._journal_offset += len(payload)
+
+            for key, (pais, name, entry) in zip(keys, entries):
+                self._data.setdefault(pais, {})[key] = entry
+                if self._changes is not None:
+                    self._changes.append((pais, key, entry))
+
+            if self._checkpoint_due():
+                self._start_checkpoint()
+        return keys
+
+    def _checkpoint_due(self):
+        """El journal ya pesa `checkpoint_ratio` del archivo (y al menos el mínimo)"""
+        if self._checkpoint_thread is not None and self._checkpoint_thread.is_alive():
+            return False
+        file_size = self._file_id[2] if self._file_id else 0
+        return self._journal_offset >= max(self.checkpoint_min_bytes,
+                                           file_size * self.checkpoint_ratio)
+
+    def _lock_checkpoint(self, blocking=False):
+        """Lock de checkpoint (uno a la vez entre workers); None si está ocupado"""
+        fd = os.open(self.checkpoint_lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _start_checkpoint(self):
+        """Tomar una copia de los datos (con el lock) y escribirla en otro hilo"""
+        checkpoint_fd = self._lock_checkpoint()
+        if checkpoint_fd is None:
+            # Otro worker ya está escribiendo un checkpoint
+            return
+        self._checkpoint_thread = threading.Thread(
+            target=self._run_checkpoint,
+            args=(checkpoint_fd, self._copy(), self._file_id, self._journal_offset),
+            name='local-checkpoint', daemon=True
+        )
+        self._checkpoint_thread.start()
+
+    def checkpoint(self):
+        """Escribir el archivo completo y rotar el journal (espera a que termine)"""
+        checkpoint_fd = self._lock_checkpoint(blocking=True)
+        with self._locked():
+            self._sync()
+            data, base_id, base_offset = self._copy(), self._file_id, self._journal_offset
+        return self._run_checkpoint(checkpoint_fd, data, base_id, base_offset)
+
+    def _run_checkpoint(self, checkpoint_fd, data, base_id, base_offset):
+        """Serializar `data` sin el flock y publicarlo si nadie se adelantó.
+
+        `data` es el contenido de `base_id` más el journal hasta `base_offset`;
+        `checkpoint_fd` es el lock de checkpoint ya tomado (se libera al final).
+        """
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        try:
+            with span('local.checkpoint'), open(tmp_path, 'w', encoding='utf-8') as fh:
+                write_locations(data, fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            del data
+
+            with self._locked():
+                self._sync()
+                if self._file_id != base_id:
+                    # Otro proceso reemplazó el archivo mientras tanto
+                    return False
+                self._commit_checkpoint(tmp_path, base_id, base_offset)
+            print(f"💾 Checkpoint de {self.path} completado")
+            return True
+        except Exception as e:
+            print(f"❌ Error en checkpoint de {self.path}: {e}")
+            traceback.print_exc()
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            os.close(checkpoint_fd)
+
+    def _commit_checkpoint(self, tmp_path, base_id, base_offset):
+        """Publicar el archivo nuevo y rotar el journal (requiere el lock)"""
+        # Lo anexado mientras se serializaba pasa al journal nuevo
+        tail = b''
+        if self._journal_offset > base_offset:
+            with open(self.journal_path, 'rb') as fh:
+                fh.seek(base_offset)
+                tail = fh.read(self._journal_offset - base_offset)
+
+        # El journal viejo queda como .prev para los workers que iban atrasados
+        journal_ino = None
+        if os.path.exists(self.journal_path):
+            prev_tmp = f"{self.prev_journal_path}.tmp{os.getpid()}"
+            if os.path.exists(prev_tmp):
+                os.remove(prev_tmp)
+            os.link(self.journal_path, prev_tmp)
+            os.replace(prev_tmp, self.prev_journal_path)
+            journal_ino = os.stat(self.prev_journal_path).st_ino
+
+        os.replace(tmp_path, self.path)
+        # Si se interrumpe aquí, el journal viejo se vuelve a aplicar con las mismas claves
+        file_id = self._stat_file()
+        header = json.dumps({"checkpoint": {
+            "base": list(base_id) if base_id else None,
+            "offset": base_offset,
+            "journal": journal_ino,
+            "file": list(file_id)
+        }}, separators=(',', ':')).encode('utf-8') + b'\n'
+
+        journal_tmp = f"{self.journal_path}.tmp{os.getpid()}"
+        with open(journal_tmp, 'wb') as fh:
+            fh.write(header)
+            fh.write(tail)
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+        os.replace(journal_tmp, self.journal_path)
+        self._file_id = file_id
+        self._journal_offset = len(header) + len(tail)
+
+
+def create_storage(backend, countries, github_repo, github_file, github_token,
+                   local_path, fsync=False):
+    """Crear el backend configurado (local si no hay GitHub Token)"""
+    if not backend:
+        backend = 'github' if github_token else 'local'
+    if backend == 'github':
+        return GithubStorage(github_repo, github_file, github_token, countries)
+    if backend == 'local':
+        print(f"💾 Almacenamiento local: {local_path}")
+        return LocalStorage(local_path, countries, fsync=fsync)
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
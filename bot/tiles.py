@@ -0,0 +1,202 @@
+"""Índice espacial y clusters por tile (z/x/y, Web Mercator) para mapas"""
+import json
+import math
+import threading
+from collections import OrderedDict
+
+# Celdas de cluster por lado de tile (8 -> celdas de 32 px en tiles de 256 px)
+TILE_GRID = 8
+TILE_GRID_SHIFT = 3
+# Niveles 0..PRECOMPUTED_MAX_ZOOM se calculan al construir el índice; los
+# niveles mayores se agrupan al vuelo desde los puntos de su tile en ese nivel
+PRECOMPUTED_MAX_ZOOM = 10
+MAX_ZOOM = 20
+TILE_CACHE_SIZE = 2048
+MAX_LATITUDE = 85.05112878
+
+
+def mercator(lat, lon):
+    """Latitud/longitud -> coordenadas Web Mercator normalizadas a [0, 1)"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    sin_lat = math.sin(math.radians(lat))
+    mx = (lon + 180.0) / 360.0
+    my = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(mx, 0.0), 0.999999999), min(max(my, 0.0), 0.999999999)
+
+
+def _cluster_cells(points, zoom):
+    """Agrupar puntos en celdas de la rejilla del nivel `zoom`"""
+    scale = (1 << zoom) * TILE_GRID
+    cells = {}
+    for point in points:
+        mx, my, lat, lon = point[:4]
+        cell = (int(mx * scale), int(my * scale))
+        current = cells.get(cell)
+        if current is None:
+            cells[cell] = [lat, lon, 1, point]
+        else:
+            current[0] += lat
+            current[1] += lon
+            current[2] += 1
+    return cells
+
+
+def _merge_cells(cells):
+    """Celdas de un nivel -> celdas del nivel superior (cada 2x2 se une)"""
+    parents = {}
+    for (cx, cy), (sum_lat, sum_lon, count, sample) in cells.items():
+        parent = (cx >> 1, cy >> 1)
+        current = parents.get(parent)
+        if current is None:
+            parents[parent] = [sum_lat, sum_lon, count, sample]
+        else:
+            current[0] += sum_lat
+            current[1] += sum_lon
+            current[2] += count
+    return parents
+
+
+def _group_by_tile(cells):
+    tiles = {}
+    for (cx, cy), cluster in cells.items():
+        tiles.setdefault((cx >> TILE_GRID_SHIFT, cy >> TILE_GRID_SHIFT), []).append(cluster)
+    return tiles
+
+
+def _point(key, entry):
+    """Registro -> (mx, my, lat, lon, clave, nombre); None si no tiene coordenadas"""
+    try:
+        lat = float(entry['lat'])
+        lon = float(entry['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    mx, my = mercator(lat, lon)
+    return (mx, my, lat, lon, key, entry.get('name', key))
+
+
+class TileIndex:
+    """Clusters precalculados por país y nivel de zoom.
+
+    Se construye una vez por snapshot (ver snapshot.register_index), fuera
+    del camino de las peticiones. Las ubicaciones aprobadas después se
+    agregan con extend() a un índice nuevo que comparte lo precalculado.
+    Las respuestas ya serializadas se guardan en un LRU pequeño.
+    """
+
+    def __init__(self, data):
+        # pais -> {(x, y) en PRECOMPUTED_MAX_ZOOM: [puntos]}
+        self.points = {}
+        # pais -> [ {(x, y): [clusters]} por nivel 0..PRECOMPUTED_MAX_ZOOM ]
+        self.levels = {}
+        # pais -> [puntos] agregados con extend(), agrupados al vuelo
+        self.extra = {}
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        for pais, entries in data.items():
+            if not isinstance(entries, dict):
+                continue
+            points = [point for point in (_point(key, entry) for key, entry in entries.items())
+                      if point is not None]
+            if points:
+                self._build(pais, points)
+
+    def extend(self, changes):
+        """Índice nuevo con las entradas (pais, clave, registro) agregadas.
+
+        Los niveles precalculados se comparten sin copiarlos; solo se copia
+        la lista de puntos agregados, que crece hasta la próxima carga completa.
+        """
+        index = TileIndex({})
+        index.points = self.points
+        index.levels = self.levels
+        index.extra = {pais: list(points) for pais, points in self.extra.items()}
+        for pais, key, entry in changes:
+            point = _point(key, entry)
+            if point is not None:
+                index.extra.setdefault(pais, []).append(point)
+        return index
+
+    def _build(self, pais, points):
+        scale = 1 << PRECOMPUTED_MAX_ZOOM
+        buckets = {}
+        for point in points:
+            buckets.setdefault((int(point[0] * scale), int(point[1] * scale)), []).append(point)
+        self.points[pais] = buckets
+
+        levels = [None] * (PRECOMPUTED_MAX_ZOOM + 1)
+        cells = _cluster_cells(points, PRECOMPUTED_MAX_ZOOM)
+        for zoom in range(PRECOMPUTED_MAX_ZOOM, -1, -1):
+            levels[zoom] = _group_by_tile(cells)
+            if zoom:
+                cells = _merge_cells(cells)
+        self.levels[pais] = levels
+
+    def clusters(self, pais, z, x, y):
+        """Clusters [sum_lat, sum_lon, count, muestra] de un tile"""
+        clusters = self._precomputed(pais, z, x, y)
+        scale = 1 << z
+        extra = [p for p in self.extra.get(pais, ())
+                 if int(p[0] * scale) == x and int(p[1] * scale) == y]
+        if not extra:
+            return clusters
+
+        # Sumar los puntos agregados a las celdas existentes (la muestra
+        # de un cluster siempre cae en su celda)
+        cell_scale = scale * TILE_GRID
+        cells = {
+            (int(cluster[3][0] * cell_scale), int(cluster[3][1] * cell_scale)): list(cluster)
+            for cluster in clusters
+        }
+        for point in extra:
+            cell = (int(point[0] * cell_scale), int(point[1] * cell_scale))
+            current = cells.get(cell)
+            if current is None:
+                cells[cell] = [point[2], point[3], 1, point]
+            else:
+                current[0] += point[2]
+                current[1] += point[3]
+                current[2] += 1
+        return list(cells.values())
+
+    def _precomputed(self, pais, z, x, y):
+        if pais not in self.levels:
+            return []
+        if z <= PRECOMPUTED_MAX_ZOOM:
+            return self.levels[pais][z].get((x, y), [])
+
+        # Nivel alto: tomar los puntos del tile padre y agruparlos al vuelo
+        shift = z - PRECOMPUTED_MAX_ZOOM
+        bucket = self.points[pais].get((x >> shift, y >> shift), ())
+        scale = 1 << z
+        inside = [p for p in bucket if int(p[0] * scale) == x and int(p[1] * scale) == y]
+        return list(_cluster_cells(inside, z).values())
+
+    def render(self, countries, z, x, y):
+        """Payload JSON compacto del tile (con caché LRU)"""
+        cache_key = (tuple(countries), z, x, y)
+        with self._cache_lock:
+            body = self._cache.get(cache_key)
+            if body is not None:
+                self._cache.move_to_end(cache_key)
+                return body
+
+        clusters = []
+        points = []
+        for pais in countries:
+            for sum_lat, sum_lon, count, sample in self.clusters(pais, z, x, y):
+                if count == 1:
+                    points.append([round(sample[2], 5), round(sample[3], 5), sample[4], sample[5], pais])
+                else:
+                    clusters.append([round(sum_lat / count, 5), round(sum_lon / count, 5), count, pais])
+
+        body = json.dumps(
+            {"z": z, "x": x, "y": y, "clusters": clusters, "points": points},
+            ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+
+        with self._cache_lock:
+            self._cache[cache_key] = body
+            if len(self._cache) > TILE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return body
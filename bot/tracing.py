@@ -0,0 +1,213 @@
+"""Trazas por petición y perfilador por muestreo (opcionales, desactivados por defecto)
+
+TRACE_ENABLED=1        spans por petición, cabecera Server-Timing y log de lentas
+TRACE_SLOW_MS=1000     umbral para imprimir el desglose de una petición lenta
+PROFILE_ENABLED=1      habilita GET /debug/profile?seconds=N (pilas "folded"); requiere DEBUG_TOKEN
+PROFILE_FILE=ruta      además, muestreo continuo volcado a <ruta>.<pid>
+PROFILE_INTERVAL_MS=5  intervalo de muestreo
+DEBUG_TOKEN=secreto    /debug/profile exige ?token= (sin token el endpoint no existe)
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', '') == '1'
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 1000))
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '') == '1'
+PROFILE_FILE = os.getenv('PROFILE_FILE', '')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN', '')
+
+_current = threading.local()
+
+
+class _NoopSpan:
+    """Span vacío: lo que se usa cuando las trazas están desactivadas"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ('name', 'start', 'spans')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.trace.spans.append((self.name, self.start - self.trace.start, end - self.start))
+        return False
+
+
+def span(name):
+    """Medir un bloque dentro de la petición actual: `with span('github.put'):`"""
+    if not TRACE_ENABLED:
+        return _NOOP
+    trace = getattr(_current, 'trace', None)
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
+
+
+def start_trace(name):
+    _current.trace = Trace(name)
+
+
+def finish_trace():
+    """Cerrar la traza actual; devuelve (traza, duración en ms) o (None, 0)"""
+    trace = getattr(_current, 'trace', None)
+    _current.trace = None
+    if trace is None:
+        return None, 0.0
+    return trace, (time.perf_counter() - trace.start) * 1000
+
+
+def format_trace(trace, total_ms):
+    lines = [f"🐢 Petición lenta {trace.name}: {total_ms:.1f} ms"]
+    for name, offset, duration in trace.spans:
+        lines.append(f"   +{offset * 1000:8.1f} ms  {duration * 1000:8.1f} ms  {name}")
+    return '\n'.join(lines)
+
+
+def server_timing(trace, total_ms):
+    """Cabecera Server-Timing (visible en las DevTools del navegador)"""
+    totals = {}
+    for name, _, duration in trace.spans:
+        totals[name] = totals.get(name, 0.0) + duration
+    parts = [f"{name.replace(' ', '_')};dur={duration * 1000:.1f}" for name, duration in totals.items()]
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ', '.join(parts)
+
+
+# ========== PERFILADOR POR MUESTREO ==========
+class Sampler:
+    """Muestrea las pilas de todos los hilos y acumula formato "folded".
+
+    La salida se puede pasar directo a flamegraph.pl o abrir en speedscope.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.counts[';'.join(reversed(stack))] += 1
+
+    def run_for(self, seconds):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self._stop.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def start(self, path=None, flush_every=60):
+        """Muestreo continuo en un hilo; vuelca a `path` cada `flush_every` s"""
+        def loop():
+            last_flush = time.monotonic()
+            while not self._stop.is_set():
+                self.sample()
+                time.sleep(self.interval)
+                if path and time.monotonic() - last_flush >= flush_every:
+                    self.dump(path)
+                    last_flush = time.monotonic()
+
+        self._thread = threading.Thread(target=loop, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def folded(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.counts.most_common()) + '\n'
+
+    def dump(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            fh.write(self.folded())
+        os.replace(tmp_path, path)
+
+
+def start_continuous_profiler():
+    """Iniciar el muestreo continuo si PROFILE_FILE está configurado (por worker)"""
+    if not PROFILE_FILE:
+        return None
+    path = f"{PROFILE_FILE}.{os.getpid()}"
+    sampler = Sampler()
+    sampler.start(path)
+    print(f"🔬 Perfilador continuo activo: {path}")
+    return sampler
+
+
+def init_app(app):
+    """Registrar los hooks de trazas y el endpoint de perfilado en Flask"""
+    from flask import request, abort, Response
+
+    if TRACE_ENABLED:
+        print(f"⏱️ Trazas activas (lentas > {TRACE_SLOW_MS:.0f} ms)")
+
+        @app.before_request
+        def _start_trace():
+            start_trace(f"{request.method} {request.path}")
+
+        @app.after_request
+        def _finish_trace(response):
+            trace, total_ms = finish_trace()
+            if trace is not None:
+                response.headers['Server-Timing'] = server_timing(trace, total_ms)
+                if total_ms >= TRACE_SLOW_MS:
+                    print(format_trace(trace, total_ms))
+            return response
+
+    if PROFILE_ENABLED and not DEBUG_TOKEN:
+        # Sin token cualquiera podría ocupar un worker hasta 2 minutos
+        print("⚠️ PROFILE_ENABLED sin DEBUG_TOKEN: /debug/profile no se registra")
+    elif PROFILE_ENABLED:
+        @app.route('/debug/profile')
+        def debug_profile():
+            """Perfilar este worker durante N segundos y devolver pilas folded"""
+            if request.args.get('token') != DEBUG_TOKEN:
+                abort(404)
+            try:
+                seconds = float(request.args.get('seconds', 10))
+                interval_ms = float(request.args.get('interval_ms', PROFILE_INTERVAL_MS))
+            except ValueError:
+                return Response("seconds e interval_ms deben ser números\n", status=400, mimetype='text/plain')
+            if not (seconds > 0 and interval_ms > 0):
+                return Response("seconds e interval_ms deben ser positivos\n", status=400, mimetype='text/plain')
+            sampler = Sampler(interval_ms)
+            sampler.run_for(min(seconds, 120))
+            return Response(sampler.folded(), mimetype='text/plain')